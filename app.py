@@ -1,10 +1,35 @@
 # app.py
 import datetime
+import functools
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
 import sqlite3
-from flask import Flask, request, jsonify, send_from_directory
-from threading import Thread
+import threading
+import time
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from threading import Lock
+from werkzeug.security import safe_join
+import bot_jobs
+import db
+import events
 import llm_bot
-from collections import Counter
+import metrics
+import write_behind
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # Optional; JSON falls back to the json module
+    orjson = None
 
 PROMPT_DB_FILE = 'prompts.db'
 
@@ -25,13 +50,182 @@ DEFAULT_PERSONAS = [
 
 SYSTEM_INSTRUCTIONS = """Here is the recent conversation:\n{context}\n\nYou must decide on one of three actions: TWEET, REPLY, or QUOTE.\nYour response MUST be in the following format, with each part on a new line:\nACTION: [Your chosen action: TWEET, REPLY, or QUOTE]\nID: [The ID of the tweet to REPLY or QUOTE. Use 0 for a new TWEET.]\nCONTENT: [The text of your tweet, reply, or quote. Must be under 280 characters.]\n\nExample for a reply:\nACTION: REPLY\nID: 3\nCONTENT: That's a fascinating point about ancient Rome!\n\nExample for a new tweet:\nACTION: TWEET\nID: 0\nCONTENT: Just learned that Vikings used sunstones for navigation. How cool is that?\n"""
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, which serializes pages of tweet
+    dicts much faster than the json module. Keys are not sorted, and int
+    keys such as those of a feed page's ``included`` become strings, as
+    they do with the json module."""
+
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        option = self.option | (orjson.OPT_INDENT_2 if kwargs.get('indent') else 0)
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        # orjson's bytes go straight into the body, without a round-trip through str
+        body = orjson.dumps(self._prepare_response_obj(args, kwargs), default=self.default, option=self.option)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
 app = Flask(__name__, static_folder='static')
+if orjson:
+    app.json = OrjsonProvider(app)
 
 DB_FILE = 'tweets.db'
+# Older tweets move here so the hot tweets table and its indexes stay small.
+# It is attached to every tweets.db connection as ARCHIVE_SCHEMA.
+ARCHIVE_DB_FILE = 'tweets_archive.db'
+ARCHIVE_SCHEMA = 'archive'
+TWEET_TABLES = ('tweets', f'{ARCHIVE_SCHEMA}.tweets')
+
+# Archival policy. A tweet is archived once it is more than
+# ARCHIVE_HOT_TWEETS ids behind the newest one or older than
+# ARCHIVE_AFTER_DAYS; archived tweets are deleted after
+# ARCHIVE_RETENTION_DAYS. 0 turns a rule off, and only the size rule is on
+# by default, as archived tweets leave trending.
+ARCHIVE_HOT_TWEETS = int(os.getenv('ARCHIVE_HOT_TWEETS', '50000'))
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '0'))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '60'))
+# Tweets moved or purged per write transaction
+ARCHIVE_BATCH = 2000
+
+# Number of change-log entries kept for delta polling. Clients whose cursor is
+# older than this fall back to a full snapshot.
+CHANGE_LOG_RETENTION = 5000
+
+TOKEN_USAGE_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20
+FEED_PAGE_LIMIT = 200
+TRENDING_PAGE_SIZE = 20
+TRENDING_PAGE_LIMIT = 100
+# Trending scores fall by a factor of e every TREND_DECAY_SECONDS. The
+# weights are what one post, reply, quote or like adds to a tweet's score.
+TREND_DECAY_SECONDS = 3600
+TREND_POST_WEIGHT = 1
+TREND_REPLY_WEIGHT = 3
+TREND_QUOTE_WEIGHT = 2
+TREND_LIKE_WEIGHT = 1
+TWEET_BATCH_LIMIT = 500
+# Default and hard limits for thread views
+THREAD_MAX_DEPTH = 50
+THREAD_MAX_NODES = 500
+THREAD_DEPTH_LIMIT = 200
+THREAD_NODE_LIMIT = 2000
+# Width in tokens of the histogram buckets behind the p50/p95 estimates
+TOKEN_HISTOGRAM_WIDTH = 25
+
+# Seconds between keep-alive comments on idle event streams
+STREAM_KEEPALIVE_SECONDS = 15
+# How often a process with stream subscribers checks for changes written by
+# other processes
+STREAM_POLL_SECONDS = 0.25
+# Each open stream holds a server thread, so a process takes at most this
+# many and answers 503 beyond it; clients then poll instead
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', '16'))
+# Retry-After on a refused stream
+STREAM_RETRY_SECONDS = 30
+
+# Rows per fetchmany() chunk on export and per executemany() batch on import
+EXPORT_CHUNK = 1000
+IMPORT_BATCH = 5000
+EXPORT_FORMAT = 1
+TWEET_EXPORT_COLUMNS = ('id', 'username', 'text', 'timestamp', 'replying_to', 'quoting_tweet_id', 'like_count')
+USAGE_EXPORT_COLUMNS = ('timestamp', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'persona')
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain'}
+# Static assets requested with a ?v= content hash never change
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+def attach_archive(conn):
+    """Attach the archive to a tweets.db connection and make sure its
+    schema exists."""
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (ARCHIVE_DB_FILE,))
+    conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.journal_mode=WAL')
+    conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.synchronous=NORMAL')
+    create_archive_schema(conn)
+
+db.add_connect_hook(DB_FILE, attach_archive)
+
+broker = events.EventBroker(max_subscribers=STREAM_MAX_SUBSCRIBERS)
+_publish_lock = Lock()
+_published_cursor = 0
+_change_poller = None
+
+# Likes and token usage are written in batches; committed likes are pushed to
+# stream subscribers like any other change.
+writer = write_behind.WriteBehind(
+    tweets_db=DB_FILE,
+    prompts_db=PROMPT_DB_FILE,
+    on_flush=lambda liked_ids: publish_changes(),
+    like_tables=TWEET_TABLES,
+)
 
 def init_db():
     """Create the SQLite database and tweets table if they don't exist."""
-    conn = sqlite3.connect(DB_FILE)
+    with db.transaction(DB_FILE) as conn:
+        create_tweet_schema(conn)
+
+# Indexes behind reply/quote lookups, their counts and timeline ordering
+TWEET_INDEXES = {
+    'idx_tweets_replying_to': 'CREATE INDEX IF NOT EXISTS idx_tweets_replying_to ON tweets(replying_to, timestamp)',
+    'idx_tweets_quoting_tweet_id': 'CREATE INDEX IF NOT EXISTS idx_tweets_quoting_tweet_id ON tweets(quoting_tweet_id, timestamp)',
+    'idx_tweets_timestamp': 'CREATE INDEX IF NOT EXISTS idx_tweets_timestamp ON tweets(timestamp)',
+    'idx_tweets_trend_score': 'CREATE INDEX IF NOT EXISTS idx_tweets_trend_score ON tweets(trend_score)',
+}
+
+def trend_time(timestamp_sql):
+    """SQL for a timestamp in units of TREND_DECAY_SECONDS since the epoch."""
+    return f"((julianday({timestamp_sql}) - 2440587.5) * {86400 / TREND_DECAY_SECONDS})"
+
+def trend_add(weight_sql, timestamp_sql):
+    """SQL for ``trend_score`` after an event of weight ``weight_sql`` at
+    ``timestamp_sql``.
+
+    A score is ln(sum(weight * e^(t / TREND_DECAY_SECONDS))) over a tweet's
+    events. Every score decays by the same factor over time, so the order
+    never changes and old scores never need rewriting. Adding an event is a
+    log-sum-exp, which also keeps the exponentials from overflowing.
+    """
+    event = f"(ln({weight_sql}) + {trend_time(timestamp_sql)})"
+    return (
+        f"CASE WHEN trend_score IS NULL THEN {event} "
+        f"ELSE MAX(trend_score, {event}) + ln(1 + exp(MIN(trend_score, {event}) - MAX(trend_score, {event}))) END"
+    )
+
+def add_trend_score_column(cur):
+    """Add and backfill ``trend_score`` on databases created before it."""
+    columns = {row[1] for row in cur.execute('PRAGMA table_info(tweets)')}
+    if 'trend_score' in columns:
+        return
+    cur.execute('ALTER TABLE tweets ADD COLUMN trend_score REAL')
+    # Recreated below without trend_score, so score updates stay out of the change log
+    cur.execute('DROP TRIGGER IF EXISTS tweets_log_update')
+    # Past engagement is counted as if it all happened when the tweet was posted
+    cur.execute(
+        f"""
+        UPDATE tweets SET trend_score = ln(
+            {TREND_POST_WEIGHT}
+            + {TREND_REPLY_WEIGHT} * (SELECT COUNT(*) FROM tweets r WHERE r.replying_to = tweets.id)
+            + {TREND_QUOTE_WEIGHT} * (SELECT COUNT(*) FROM tweets q WHERE q.quoting_tweet_id = tweets.id)
+            + {TREND_LIKE_WEIGHT} * MAX(COALESCE(like_count, 0), 0)
+        ) + {trend_time('timestamp')}
+        """
+    )
+
+FTS_INSERT_TRIGGER = """
+        CREATE TRIGGER IF NOT EXISTS tweets_fts_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweets_fts (rowid, text, username) VALUES (NEW.id, NEW.text, NEW.username);
+        END"""
+
+def create_tweet_schema(conn):
     cur = conn.cursor()
     cur.execute(
         """
@@ -42,215 +236,1296 @@ def init_db():
             timestamp TEXT NOT NULL,
             replying_to INTEGER,
             quoting_tweet_id INTEGER,
-            like_count INTEGER DEFAULT 0
+            like_count INTEGER DEFAULT 0,
+            trend_score REAL
         )
         """
     )
-    conn.commit()
-    conn.close()
+    # IF NOT EXISTS also adds the indexes to databases created before they
+    # existed. The reply/quote indexes go first, so the trend_score backfill
+    # counts with index lookups; the trend_score index needs the column.
+    for name, statement in TWEET_INDEXES.items():
+        if name != 'idx_tweets_trend_score':
+            cur.execute(statement)
+    add_trend_score_column(cur)
+    cur.execute(TWEET_INDEXES['idx_tweets_trend_score'])
+    # Ids being moved to the archive. Their deletes from this table are not
+    # logged as changes, since the tweets still exist.
+    cur.execute('CREATE TABLE IF NOT EXISTS archive_pending (id INTEGER PRIMARY KEY)')
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='tweets_log_delete'")
+    row = cur.fetchone()
+    if row and 'archive_pending' not in row[0]:
+        # Recreated below to skip archive moves
+        cur.execute('DROP TRIGGER tweets_log_delete')
+    # Change log read by pollers asking for deltas. Triggers record every
+    # tweet whose row or reply/quote counts changed, so writers don't have to.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tweet_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tweet_id INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.executescript(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS tweets_log_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id) VALUES (NEW.id);
+            INSERT INTO tweet_changes (tweet_id) SELECT NEW.replying_to WHERE NEW.replying_to IS NOT NULL;
+            INSERT INTO tweet_changes (tweet_id) SELECT NEW.quoting_tweet_id WHERE NEW.quoting_tweet_id IS NOT NULL;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tweets_log_update
+        AFTER UPDATE OF username, text, timestamp, replying_to, quoting_tweet_id, like_count ON tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id) VALUES (NEW.id);
+        END;
+        -- Trending scores: the post itself, then replies, quotes and likes
+        CREATE TRIGGER IF NOT EXISTS tweets_trend_insert AFTER INSERT ON tweets BEGIN
+            UPDATE tweets SET trend_score = {trend_add(TREND_POST_WEIGHT, 'NEW.timestamp')} WHERE id = NEW.id;
+            UPDATE tweets SET trend_score = {trend_add(TREND_REPLY_WEIGHT, 'NEW.timestamp')} WHERE id = NEW.replying_to;
+            UPDATE tweets SET trend_score = {trend_add(TREND_QUOTE_WEIGHT, 'NEW.timestamp')} WHERE id = NEW.quoting_tweet_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tweets_trend_like AFTER UPDATE OF like_count ON tweets
+        WHEN NEW.like_count > COALESCE(OLD.like_count, 0) BEGIN
+            UPDATE tweets SET trend_score = {trend_add(f'{TREND_LIKE_WEIGHT} * (NEW.like_count - COALESCE(OLD.like_count, 0))', "'now'")}
+            WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tweets_log_delete AFTER DELETE ON tweets
+        WHEN OLD.id NOT IN (SELECT id FROM archive_pending) BEGIN
+            INSERT INTO tweet_changes (tweet_id, deleted) VALUES (OLD.id, 1);
+            INSERT INTO tweet_changes (tweet_id) SELECT OLD.replying_to WHERE OLD.replying_to IS NOT NULL;
+            INSERT INTO tweet_changes (tweet_id) SELECT OLD.quoting_tweet_id WHERE OLD.quoting_tweet_id IS NOT NULL;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tweet_changes_prune AFTER INSERT ON tweet_changes BEGIN
+            DELETE FROM tweet_changes WHERE seq <= NEW.seq - {CHANGE_LOG_RETENTION};
+        END;
+        """
+    )
+    create_search_index(cur)
 
-def load_tweets():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM tweets')
-    tweets = [dict(row) for row in cur.fetchall()]
-    conn.close()
+def create_search_index(cur):
+    """Full-text index over tweet text and username, kept in sync by triggers."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='tweets_fts'")
+    exists = cur.fetchone() is not None
+    cur.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(
+            text, username, content='tweets', content_rowid='id'
+        );
+        {FTS_INSERT_TRIGGER};
+        CREATE TRIGGER IF NOT EXISTS tweets_fts_delete AFTER DELETE ON tweets BEGIN
+            INSERT INTO tweets_fts (tweets_fts, rowid, text, username) VALUES ('delete', OLD.id, OLD.text, OLD.username);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tweets_fts_update AFTER UPDATE OF text, username ON tweets BEGIN
+            INSERT INTO tweets_fts (tweets_fts, rowid, text, username) VALUES ('delete', OLD.id, OLD.text, OLD.username);
+            INSERT INTO tweets_fts (rowid, text, username) VALUES (NEW.id, NEW.text, NEW.username);
+        END;
+        """
+    )
+    if not exists:
+        # One-time backfill for databases that predate the index
+        cur.execute("INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')")
+
+def create_archive_schema(conn):
+    """Archive tables, plus TEMP triggers that log likes on and deletes of
+    archived tweets in tweet_changes. A trigger stored in one database can't
+    write to another, so those are recreated on every connection."""
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.tweets (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            text TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            replying_to INTEGER,
+            quoting_tweet_id INTEGER,
+            like_count INTEGER DEFAULT 0,
+            trend_score REAL
+        );
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_tweets_replying_to ON tweets(replying_to, timestamp);
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_tweets_quoting_tweet_id ON tweets(quoting_tweet_id, timestamp);
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_tweets_timestamp ON tweets(timestamp);
+        CREATE VIRTUAL TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.tweets_fts USING fts5(
+            text, username, content='tweets', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS {ARCHIVE_SCHEMA}.tweets_fts_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweets_fts (rowid, text, username) VALUES (NEW.id, NEW.text, NEW.username);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {ARCHIVE_SCHEMA}.tweets_fts_delete AFTER DELETE ON tweets BEGIN
+            INSERT INTO tweets_fts (tweets_fts, rowid, text, username) VALUES ('delete', OLD.id, OLD.text, OLD.username);
+        END;
+        CREATE TEMP TRIGGER IF NOT EXISTS archive_log_update AFTER UPDATE OF like_count ON {ARCHIVE_SCHEMA}.tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id) VALUES (NEW.id);
+        END;
+        CREATE TEMP TRIGGER IF NOT EXISTS archive_log_delete AFTER DELETE ON {ARCHIVE_SCHEMA}.tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id, deleted) VALUES (OLD.id, 1);
+            INSERT INTO tweet_changes (tweet_id) SELECT OLD.replying_to WHERE OLD.replying_to IS NOT NULL;
+            INSERT INTO tweet_changes (tweet_id) SELECT OLD.quoting_tweet_id WHERE OLD.quoting_tweet_id IS NOT NULL;
+        END;
+        """
+    )
+
+def union_tweets(template):
+    """Repeat an SQL ``template`` once per table in TWEET_TABLES, with
+    ``{tweets}`` filled in, joined by UNION ALL. The hot table and the
+    archive then read as one; the caller repeats the params per table."""
+    return ' UNION ALL '.join(template.format(tweets=table) for table in TWEET_TABLES)
+
+# Each count is an index lookup on idx_tweets_replying_to / idx_tweets_quoting_tweet_id
+# in the hot table and in the archive
+COUNT_COLUMNS = {
+    'reply_count': f"""
+        ((SELECT COUNT(*) FROM tweets r WHERE r.replying_to = t.id)
+            + (SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.tweets r WHERE r.replying_to = t.id)) AS reply_count""",
+    'quote_count': f"""
+        ((SELECT COUNT(*) FROM tweets q WHERE q.quoting_tweet_id = t.id)
+            + (SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.tweets q WHERE q.quoting_tweet_id = t.id)) AS quote_count""",
+}
+# Everything a tweet endpoint can return, and what ?fields= may pick from.
+# trend_score is internal; /api/trending turns it into a decayed ``trend``.
+TWEET_FIELDS = (
+    'id', 'username', 'text', 'timestamp', 'replying_to', 'quoting_tweet_id', 'like_count',
+    *COUNT_COLUMNS,
+)
+
+def tweet_columns(fields=None, required=()):
+    """SQL select list for the tweet ``fields`` (all of them when None) plus
+    the ``required`` columns the query itself needs. Counts that aren't
+    asked for are left out, along with their subqueries."""
+    names = [name for name in TWEET_FIELDS if fields is None or name in fields]
+    names += [name for name in required if name not in names]
+    return ', '.join(COUNT_COLUMNS.get(name, f't.{name}') for name in names)
+
+def fetch_tweets(cur, sql, params=()):
+    """Run a tweet query and return its rows as dicts. Rows are fetched as
+    plain tuples and zipped with one tuple of column names, rather than
+    built as an sqlite3.Row each and then copied."""
+    cur.row_factory = None
+    cur.execute(sql, params)
+    columns = tuple(column[0] for column in cur.description)
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def project_tweets(tweets, fields, keep=()):
+    """Drop the keys of ``tweets`` that the ``?fields=`` projection didn't
+    ask for, apart from ``keep``, in place. Queries may select a few more
+    columns than requested for their own ordering and cursors."""
+    if fields is not None and tweets:
+        drop = set(tweets[0]).difference(fields, keep)
+        for tweet in tweets:
+            for key in drop:
+                del tweet[key]
     return tweets
 
+def select_tweets(cur, where='', params=(), order=None, limit=None, fields=None, required=('id', 'timestamp')):
+    """Return tweets with their counts from the hot table and the archive.
+
+    ``where`` filters each table, and ``order`` (result column names) sorts
+    the merged rows. ``limit`` applies to each table before the merge as
+    well as to the result. A limited, ordered query is then two index range
+    scans, however large either table gets. ``fields`` and ``required`` are
+    passed to ``tweet_columns``.
+    """
+    part = f'SELECT {tweet_columns(fields, required)} FROM {{tweets}} t {where}'
+    params = tuple(params)
+    if limit:
+        part = f'SELECT * FROM ({part} ORDER BY {order} LIMIT ?)'
+        params += (limit,)
+    sql = union_tweets(part)
+    params *= len(TWEET_TABLES)
+    if order:
+        sql += f' ORDER BY {order}'
+    if limit:
+        sql += ' LIMIT ?'
+        params += (limit,)
+    return fetch_tweets(cur, sql, params)
+
+@metrics.timed_query
+def load_tweets(replying_to=None, quoting=None, limit=None, fields=None):
+    """Return tweets with reply/quote counts, newest first.
+
+    ``replying_to`` / ``quoting`` restrict the result to replies to or quotes
+    of one tweet, and ``limit`` to the newest N. ``fields`` selects the
+    columns, as for ``select_tweets``.
+    """
+    where = ''
+    params = ()
+    if replying_to:
+        where = 'WHERE t.replying_to = ?'
+        params = (replying_to,)
+    elif quoting:
+        where = 'WHERE t.quoting_tweet_id = ?'
+        params = (quoting,)
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+        tweets = select_tweets(cur, where, params, 'timestamp DESC, id DESC', limit, fields)
+    return write_behind.add_pending_likes(tweets, pending)
+
+@metrics.timed_query
+@db.retry_on_busy
 def insert_tweet(tweet):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        'INSERT INTO tweets (username, text, timestamp, replying_to, quoting_tweet_id, like_count) VALUES (?, ?, ?, ?, ?, ?)',
-        (
-            tweet['username'],
-            tweet['text'],
-            tweet['timestamp'],
-            tweet['replying_to'],
-            tweet['quoting_tweet_id'],
-            tweet['like_count'],
-        ),
-    )
-    conn.commit()
-    tweet_id = cur.lastrowid
-    conn.close()
-    return tweet_id
+    with db.transaction(DB_FILE) as conn:
+        cur = conn.execute(
+            'INSERT INTO tweets (username, text, timestamp, replying_to, quoting_tweet_id, like_count) VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                tweet['username'],
+                tweet['text'],
+                tweet['timestamp'],
+                tweet['replying_to'],
+                tweet['quoting_tweet_id'],
+                tweet['like_count'],
+            ),
+        )
+        return cur.lastrowid
+
+def last_tweet_id(conn):
+    """Highest tweet id ever assigned, including deleted tweets, as
+    AUTOINCREMENT never reuses them. Call inside a write transaction."""
+    return conn.execute(
+        "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name='tweets'), 0),"
+        " (SELECT COALESCE(MAX(id), 0) FROM tweets))"
+    ).fetchone()[0]
+
+def batch_ref_index(ref):
+    """Return N for an intra-batch reference ``"$N"``, else None."""
+    if isinstance(ref, str) and ref.startswith('$') and ref[1:].isdigit():
+        return int(ref[1:])
+    return None
+
+@metrics.timed_query(rows=len)
+@db.retry_on_busy
+def insert_tweets(tweets):
+    """Insert ``tweets`` in one transaction and return their ids in order.
+
+    The ids are assigned as one contiguous block under BEGIN IMMEDIATE, so
+    ``replying_to``/``quoting_tweet_id`` may be ``"$N"`` to point at the
+    N-th tweet of the same batch before any of it is written.
+    """
+    with db.transaction(DB_FILE) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        first_id = last_tweet_id(conn) + 1
 
+        def resolve(ref):
+            index = batch_ref_index(ref)
+            return ref if index is None else first_id + index
+
+        conn.executemany(
+            'INSERT INTO tweets (id, username, text, timestamp, replying_to, quoting_tweet_id, like_count) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    first_id + i,
+                    tweet['username'],
+                    tweet['text'],
+                    tweet['timestamp'],
+                    resolve(tweet['replying_to']),
+                    resolve(tweet['quoting_tweet_id']),
+                    tweet['like_count'],
+                )
+                for i, tweet in enumerate(tweets)
+            ],
+        )
+        return [first_id + i for i in range(len(tweets))]
+
+@metrics.timed_query
+@db.retry_on_busy
 def delete_tweet_db(tweet_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute('DELETE FROM tweets WHERE id=?', (tweet_id,))
-    conn.commit()
-    rows = cur.rowcount
-    conn.close()
-    return rows > 0
-
-def get_tweet(tweet_id):
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM tweets WHERE id=?', (tweet_id,))
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    # A tweet being archived can briefly be in both tables. Unstaging it
+    # first gets its delete logged and keeps it from being copied.
+    with db.transaction(DB_FILE) as conn:
+        conn.execute('DELETE FROM archive_pending WHERE id=?', (tweet_id,))
+        deleted = 0
+        for table in TWEET_TABLES:
+            deleted += conn.execute(f'DELETE FROM {table} WHERE id=?', (tweet_id,)).rowcount
+        return deleted > 0
+
+@metrics.timed_query
+def load_trending(limit=TRENDING_PAGE_SIZE, fields=None):
+    """Return the ``limit`` highest-scoring tweets, hottest first.
+
+    This walks idx_tweets_trend_score from the top, so the cost depends on
+    ``limit`` and not on the table size. Each tweet gets a ``trend`` value:
+    its weighted engagement decayed to the present. Archived tweets are too
+    old to trend and are left out.
+    """
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        tweets = fetch_tweets(
+            conn.cursor(),
+            f'SELECT {tweet_columns(fields, ("id", "trend_score"))} FROM tweets t'
+            ' WHERE t.trend_score IS NOT NULL ORDER BY t.trend_score DESC LIMIT ?',
+            (limit,),
+        )
+    now = time.time() / TREND_DECAY_SECONDS
+    for tweet in tweets:
+        tweet['trend'] = round(math.exp(min(tweet.pop('trend_score') - now, 700)), 4)
+    return write_behind.add_pending_likes(tweets, pending)
+
+@metrics.timed_query
+def get_tweet(tweet_id, fields=None):
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        tweets = select_tweets(conn.cursor(), 'WHERE t.id = ?', (tweet_id,), fields=fields)
+    if not tweets:
+        return None
+    return write_behind.add_pending_likes(tweets, pending)[0]
 
 def init_prompt_db():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    # Personas table
+    with db.transaction(PROMPT_DB_FILE) as conn:
+        cur = conn.cursor()
+        # Personas table
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS personas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                prompt TEXT NOT NULL
+            )
+            """
+        )
+        # System prompt table with a single row
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS system_prompt (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                instructions TEXT NOT NULL
+            )
+            """
+        )
+        # Table to log LLM token usage
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER,
+                persona TEXT
+            )
+            """
+        )
+
+        # Seed personas if empty
+        cur.execute("SELECT COUNT(*) FROM personas")
+        if cur.fetchone()[0] == 0:
+            cur.executemany(
+                "INSERT INTO personas (name, prompt) VALUES (?, ?)",
+                DEFAULT_PERSONAS,
+            )
+
+        # Ensure system prompt row exists
+        cur.execute("SELECT COUNT(*) FROM system_prompt")
+        if cur.fetchone()[0] == 0:
+            cur.execute(
+                "INSERT INTO system_prompt (id, instructions) VALUES (1, ?)",
+                (SYSTEM_INSTRUCTIONS,),
+            )
+
+        create_token_usage_rollups(cur)
+        llm_bot.create_config_version(cur)
+
+def create_token_usage_rollups(cur):
+    """Summary tables kept up to date by a trigger on token_usage, so usage
+    reports never scan the raw log."""
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS personas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            prompt TEXT NOT NULL
+        CREATE TABLE IF NOT EXISTS token_usage_hourly (
+            hour TEXT NOT NULL,
+            persona TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            PRIMARY KEY (hour, persona)
         )
         """
     )
-    # System prompt table with a single row
+    # Calls per TOKEN_HISTOGRAM_WIDTH-wide range of total_tokens, for percentiles
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS system_prompt (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            instructions TEXT NOT NULL
+        CREATE TABLE IF NOT EXISTS token_usage_histogram (
+            bucket INTEGER PRIMARY KEY,
+            calls INTEGER NOT NULL
         )
         """
     )
-    # Table to log LLM token usage
+    cur.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name='token_usage_rollup'")
+    if cur.fetchone():
+        return
     cur.execute(
+        f"""
+        CREATE TRIGGER token_usage_rollup AFTER INSERT ON token_usage BEGIN
+            INSERT INTO token_usage_hourly (hour, persona, calls, prompt_tokens, completion_tokens, total_tokens)
+            VALUES (
+                substr(NEW.timestamp, 1, 13), COALESCE(NEW.persona, ''), 1,
+                COALESCE(NEW.prompt_tokens, 0), COALESCE(NEW.completion_tokens, 0), COALESCE(NEW.total_tokens, 0)
+            )
+            ON CONFLICT (hour, persona) DO UPDATE SET
+                calls = calls + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                total_tokens = total_tokens + excluded.total_tokens;
+            INSERT INTO token_usage_histogram (bucket, calls)
+            VALUES (COALESCE(NEW.total_tokens, 0) / {TOKEN_HISTOGRAM_WIDTH}, 1)
+            ON CONFLICT (bucket) DO UPDATE SET calls = calls + 1;
+        END
         """
-        CREATE TABLE IF NOT EXISTS token_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            prompt_tokens INTEGER,
-            completion_tokens INTEGER,
-            total_tokens INTEGER,
-            persona TEXT
-        )
+    )
+    # First run against an existing prompts.db: backfill from the raw log
+    cur.execute(
+        """
+        INSERT INTO token_usage_hourly
+        SELECT substr(timestamp, 1, 13), COALESCE(persona, ''), COUNT(*),
+            COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(total_tokens), 0)
+        FROM token_usage GROUP BY 1, 2
+        """
+    )
+    cur.execute(
+        f"""
+        INSERT INTO token_usage_histogram
+        SELECT COALESCE(total_tokens, 0) / {TOKEN_HISTOGRAM_WIDTH}, COUNT(*) FROM token_usage GROUP BY 1
         """
     )
-    conn.commit()
-
-    # Seed personas if empty
-    cur.execute("SELECT COUNT(*) FROM personas")
-    if cur.fetchone()[0] == 0:
-        cur.executemany(
-            "INSERT INTO personas (name, prompt) VALUES (?, ?)",
-            DEFAULT_PERSONAS,
-        )
-        conn.commit()
-
-    # Ensure system prompt row exists
-    cur.execute("SELECT COUNT(*) FROM system_prompt")
-    if cur.fetchone()[0] == 0:
-        cur.execute(
-            "INSERT INTO system_prompt (id, instructions) VALUES (1, ?)",
-            (SYSTEM_INSTRUCTIONS,),
-        )
-        conn.commit()
-
-    conn.close()
 
+@metrics.timed_query
 def load_personas():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT name, prompt FROM personas")
-    personas = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    return personas
+    with db.connect(PROMPT_DB_FILE) as conn:
+        return [dict(row) for row in conn.execute("SELECT name, prompt FROM personas")]
 
+@metrics.timed_query
 def load_system_prompt():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT instructions FROM system_prompt WHERE id=1")
-    row = cur.fetchone()
-    conn.close()
+    with db.connect(PROMPT_DB_FILE) as conn:
+        row = conn.execute("SELECT instructions FROM system_prompt WHERE id=1").fetchone()
     return row[0] if row else SYSTEM_INSTRUCTIONS
 
+@metrics.timed_query
+@db.retry_on_busy
 def update_system_prompt_db(instructions):
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE system_prompt SET instructions=? WHERE id=1",
-        (instructions,),
-    )
-    conn.commit()
-    conn.close()
-    global SYSTEM_INSTRUCTIONS
-    SYSTEM_INSTRUCTIONS = instructions
+    with db.transaction(PROMPT_DB_FILE) as conn:
+        conn.execute(
+            "UPDATE system_prompt SET instructions=? WHERE id=1",
+            (instructions,),
+        )
 
 def log_token_usage(prompt_tokens, completion_tokens, total_tokens, persona):
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO token_usage (timestamp, prompt_tokens, completion_tokens, total_tokens, persona) VALUES (?, ?, ?, ?, ?)",
+    writer.add_token_usage(
         (
             datetime.datetime.utcnow().isoformat() + 'Z',
             prompt_tokens,
             completion_tokens,
             total_tokens,
             persona,
-        ),
+        )
     )
-    conn.commit()
-    conn.close()
 
-def load_token_usage():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT timestamp, prompt_tokens, completion_tokens, total_tokens, persona FROM token_usage ORDER BY id DESC")
-    rows = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    return rows
+@metrics.timed_query
+def load_token_usage(limit=TOKEN_USAGE_PAGE_SIZE, before_id=None):
+    """Return one page of usage rows, newest first, keyed on id."""
+    query = "SELECT id, timestamp, prompt_tokens, completion_tokens, total_tokens, persona FROM token_usage"
+    params = ()
+    if before_id:
+        query += " WHERE id < ?"
+        params = (before_id,)
+    query += " ORDER BY id DESC LIMIT ?"
+    with db.connect(PROMPT_DB_FILE) as conn:
+        return [dict(row) for row in conn.execute(query, params + (limit,))]
 
-def increment_like(tweet_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute('UPDATE tweets SET like_count = COALESCE(like_count, 0) + 1 WHERE id=?', (tweet_id,))
-    conn.commit()
-    conn.close()
-
-def add_interaction_counts(tweets):
-    reply_counts = Counter(t['replying_to'] for t in tweets if t.get('replying_to'))
-    quote_counts = Counter(t['quoting_tweet_id'] for t in tweets if t.get('quoting_tweet_id'))
-    
-    for tweet in tweets:
-        tweet['reply_count'] = reply_counts.get(tweet['id'], 0)
-        tweet['quote_count'] = quote_counts.get(tweet['id'], 0)
-    return tweets
+def histogram_percentile(buckets, total_calls, fraction):
+    """Upper bound of the histogram bucket holding the given percentile."""
+    threshold = total_calls * fraction
+    seen = 0
+    for bucket, calls in buckets:
+        seen += calls
+        if seen >= threshold:
+            return (bucket + 1) * TOKEN_HISTOGRAM_WIDTH - 1
+    return None
+
+@metrics.timed_query
+def load_token_usage_summary():
+    """Totals per persona plus approximate p50/p95 tokens per call."""
+    with db.connect(PROMPT_DB_FILE) as conn:
+        personas = [
+            dict(row) for row in conn.execute(
+                """
+                SELECT persona, SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                    SUM(completion_tokens) AS completion_tokens, SUM(total_tokens) AS total_tokens
+                FROM token_usage_hourly GROUP BY persona ORDER BY total_tokens DESC
+                """
+            )
+        ]
+        buckets = conn.execute("SELECT bucket, calls FROM token_usage_histogram ORDER BY bucket").fetchall()
+    totals = {
+        key: sum(p[key] for p in personas)
+        for key in ('calls', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+    }
+    return {
+        'totals': totals,
+        'personas': personas,
+        'percentiles': {
+            'p50': histogram_percentile(buckets, totals['calls'], 0.50),
+            'p95': histogram_percentile(buckets, totals['calls'], 0.95),
+            'bucket_width': TOKEN_HISTOGRAM_WIDTH,
+        },
+    }
+
+@metrics.timed_query
+def load_token_usage_buckets(bucket='hour', limit=48):
+    """Usage per hour or day bucket, most recent first."""
+    key = 'hour' if bucket == 'hour' else 'substr(hour, 1, 10)'
+    with db.connect(PROMPT_DB_FILE) as conn:
+        cur = conn.execute(
+            f"""
+            SELECT {key} AS bucket, SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                SUM(completion_tokens) AS completion_tokens, SUM(total_tokens) AS total_tokens
+            FROM token_usage_hourly GROUP BY 1 ORDER BY 1 DESC LIMIT ?
+            """,
+            (limit,),
+        )
+        return [dict(row) for row in cur]
+
+@metrics.timed_query(rows=lambda result: len(result[0]) + len(result[1]))
+def load_thread(tweet_id, max_depth=THREAD_MAX_DEPTH, max_nodes=THREAD_MAX_NODES, fields=None):
+    """Return (ancestors, replies, truncated) for the conversation around a tweet.
+
+    ``ancestors`` runs from the root down to the tweet's direct parent.
+    ``replies`` is the descendant reply tree, breadth first, each tweet tagged
+    with its ``depth`` below the tweet. Both walks follow idx_tweets_replying_to
+    and stop at ``max_depth`` levels; the reply walk also stops after
+    ``max_nodes`` tweets, in which case ``truncated`` is true. Each step
+    looks in the hot table and the archive, so a thread can span both.
+    """
+    if max_depth < 1:
+        return [], [], False
+    tables = len(TWEET_TABLES)
+    columns = tweet_columns(fields, ('id', 'timestamp'))
+    ancestor_steps = union_tweets(
+        'SELECT p.replying_to, a.depth + 1 FROM {tweets} p JOIN ancestors a ON p.id = a.id'
+        ' WHERE p.replying_to IS NOT NULL AND a.depth < ?'
+    )
+    ancestor_rows = union_tweets(f'SELECT {columns}, a.depth FROM ancestors a JOIN {{tweets}} t ON t.id = a.id')
+    reply_steps = union_tweets(
+        'SELECT r.id, p.depth + 1 FROM {tweets} r JOIN replies p ON r.replying_to = p.id WHERE p.depth < ?'
+    )
+    reply_rows = union_tweets(f'SELECT {columns}, r.depth FROM replies r JOIN {{tweets}} t ON t.id = r.id')
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+        ancestors = fetch_tweets(
+            cur,
+            f"""
+            WITH RECURSIVE ancestors(id, depth) AS (
+                {union_tweets('SELECT replying_to, 1 FROM {tweets} WHERE id = ? AND replying_to IS NOT NULL')}
+                UNION ALL
+                {ancestor_steps}
+            )
+            SELECT * FROM ({ancestor_rows})
+            ORDER BY depth DESC
+            """,
+            (tweet_id,) * tables + (max_depth,) * tables,
+        )
+        replies = fetch_tweets(
+            cur,
+            f"""
+            WITH RECURSIVE replies(id, depth) AS (
+                {union_tweets('SELECT id, 1 FROM {tweets} WHERE replying_to = ?')}
+                UNION ALL
+                {reply_steps}
+                LIMIT ?
+            )
+            SELECT * FROM ({reply_rows})
+            ORDER BY depth, timestamp, id
+            """,
+            (tweet_id,) * tables + (max_depth,) * tables + (max_nodes + 1,),
+        )
+    truncated = len(replies) > max_nodes
+    if truncated:
+        replies = replies[:max_nodes]
+    write_behind.add_pending_likes(ancestors, pending)
+    write_behind.add_pending_likes(replies, pending)
+    return ancestors, replies, truncated
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, each as a
+    prefix. Quoting the words keeps FTS syntax in user input inert."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{w}"*' for w in words)
+
+@metrics.timed_query
+def search_tweets(query, limit=SEARCH_PAGE_SIZE, after=None, fields=None):
+    """Rank tweets matching ``query`` by bm25, best first.
+
+    ``after`` is the (rank, id) of the last result of the previous page.
+    Each result carries a ``snippet`` with matches wrapped in <mark>.
+
+    The hot table and the archive have their own full-text index; each is
+    searched for a page and the two are merged by rank. bm25 ranks from
+    the two indexes are close but not strictly comparable.
+    """
+    part = f"""
+        SELECT {tweet_columns(fields, ('id',))},
+            snippet(tweets_fts, 0, '<mark>', '</mark>', '…', 16) AS snippet,
+            tweets_fts.rank AS rank
+        FROM {{schema}}tweets_fts JOIN {{schema}}tweets t ON t.id = tweets_fts.rowid
+        WHERE tweets_fts MATCH ?
+    """
+    params = [query]
+    if after:
+        part += ' AND (tweets_fts.rank > ? OR (tweets_fts.rank = ? AND t.id > ?))'
+        params += [after[0], after[0], after[1]]
+    part = f'SELECT * FROM ({part} ORDER BY tweets_fts.rank, t.id LIMIT ?)'
+    params.append(limit)
+    sql = ' UNION ALL '.join(part.format(schema=schema) for schema in ('', f'{ARCHIVE_SCHEMA}.'))
+    sql += ' ORDER BY rank, id LIMIT ?'
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        tweets = fetch_tweets(conn.cursor(), sql, params * 2 + [limit])
+    return write_behind.add_pending_likes(tweets, pending)
+
+def current_change_cursor(cur):
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name='tweet_changes'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+@metrics.timed_query(rows=lambda result: len(result[1] or ()) + len(result[2]))
+def load_changes(since, fields=None):
+    """Return (cursor, changed_tweets, deleted_ids) for changes after ``since``.
+
+    ``changed_tweets`` is None when the change log no longer reaches back to
+    ``since`` and the caller has to resync from a full snapshot.
+    """
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        # One read transaction so the cursor matches the rows we return
+        cur.execute('BEGIN')
+        cursor = current_change_cursor(cur)
+        cur.execute('SELECT MIN(seq) FROM tweet_changes')
+        oldest = cur.fetchone()[0]
+        if since <= 0 or since > cursor or (oldest is not None and since < oldest - 1):
+            return cursor, None, []
+
+        cur.execute('SELECT tweet_id, MAX(deleted) FROM tweet_changes WHERE seq > ? GROUP BY tweet_id', (since,))
+        deleted_ids = []
+        changed_ids = []
+        for tweet_id, deleted in cur.fetchall():
+            (deleted_ids if deleted else changed_ids).append(tweet_id)
+
+        tweets = []
+        if changed_ids:
+            placeholders = ','.join('?' * len(changed_ids))
+            tweets = select_tweets(cur, f'WHERE t.id IN ({placeholders})', changed_ids, fields=fields)
+    return cursor, write_behind.add_pending_likes(tweets, pending), deleted_ids
+
+@metrics.timed_query(rows=lambda result: len(result[1]))
+def load_tweets_snapshot(fields=None):
+    """Return (cursor, tweets) read in a single transaction."""
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+        cursor = current_change_cursor(cur)
+        tweets = select_tweets(cur, order='timestamp DESC, id DESC', fields=fields)
+    return cursor, write_behind.add_pending_likes(tweets, pending)
+
+@metrics.timed_query(rows=lambda result: len(result[1]) + len(result[2]))
+def load_feed_page(limit, before=None, fields=None):
+    """Return (cursor, tweets, included) for one page of the main feed.
+
+    Pages are keyed on (timestamp, id) so each one is an index range scan
+    on idx_tweets_timestamp no matter how deep the client has scrolled.
+    ``before`` is the (timestamp, id) of the last tweet on the previous page.
+    ``included`` maps id -> tweet for reply parents and quoted tweets the
+    page refers to but doesn't contain. Pages past the hot table continue
+    into the archive at the same cost.
+    """
+    where = 'WHERE (t.timestamp, t.id) < (?, ?)' if before else ''
+    # The references are needed to find the included tweets
+    required = ('id', 'timestamp', 'replying_to', 'quoting_tweet_id')
+    with writer.reading_likes() as pending, db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+        cursor = current_change_cursor(cur)
+        tweets = select_tweets(cur, where, before or (), 'timestamp DESC, id DESC', limit, fields, required)
+        page_ids = {t['id'] for t in tweets}
+        ref_ids = {
+            ref for t in tweets for ref in (t['replying_to'], t['quoting_tweet_id'])
+            if ref and ref not in page_ids
+        }
+        included = []
+        if ref_ids:
+            placeholders = ','.join('?' * len(ref_ids))
+            included = select_tweets(cur, f'WHERE t.id IN ({placeholders})', ref_ids, fields=fields)
+    write_behind.add_pending_likes(tweets, pending)
+    write_behind.add_pending_likes(included, pending)
+    return cursor, tweets, {t['id']: t for t in included}
+
+def feed_page_response(limit, before=None, fields=None, **extra):
+    cursor, tweets, included = load_feed_page(limit, before, fields)
+    next_before = None
+    if len(tweets) == limit:
+        last = tweets[-1]
+        next_before = f"{last['timestamp']}|{last['id']}"
+    project_tweets(tweets, fields)
+    project_tweets(list(included.values()), fields)
+    return jsonify({'cursor': cursor, 'tweets': tweets, 'included': included, 'next': next_before, **extra})
+
+def export_ndjson(tables=('tweets', 'token_usage')):
+    """Yield the database as NDJSON, a chunk of lines at a time.
+
+    The first line is a ``meta`` record with the highest exported tweet id,
+    which lets ``import_ndjson`` reserve ids up front. Tweets follow in id
+    order, so a reply always comes after the tweet it replies to, then token
+    usage rows. Each table is read in one transaction and streamed with
+    fetchmany, so memory use doesn't depend on the table size. Archived
+    tweets are merged in by id.
+    """
+    writer.flush()
+    with db.connect(DB_FILE) as conn:
+        conn.execute('BEGIN')
+        max_id = conn.execute(
+            f"SELECT COALESCE(MAX(id), 0) FROM ({union_tweets('SELECT MAX(id) AS id FROM {tweets}')})"
+        ).fetchone()[0]
+        yield json.dumps({'type': 'meta', 'format': EXPORT_FORMAT, 'tweets_max_id': max_id}) + '\n'
+        if 'tweets' in tables:
+            cur = conn.execute(union_tweets(f"SELECT {', '.join(TWEET_EXPORT_COLUMNS)} FROM {{tweets}}") + ' ORDER BY id')
+            while rows := cur.fetchmany(EXPORT_CHUNK):
+                yield ''.join(json.dumps({'type': 'tweet', **dict(row)}) + '\n' for row in rows)
+    if 'token_usage' in tables:
+        with db.connect(PROMPT_DB_FILE) as conn:
+            cur = conn.execute(f"SELECT {', '.join(USAGE_EXPORT_COLUMNS)} FROM token_usage ORDER BY id")
+            while rows := cur.fetchmany(EXPORT_CHUNK):
+                yield ''.join(json.dumps({'type': 'token_usage', **dict(row)}) + '\n' for row in rows)
+
+def import_ndjson(lines, defer_indexes=False):
+    """Append tweets and token usage from NDJSON ``lines`` (bytes or str).
+
+    The input must start with the ``meta`` record from ``export_ndjson``.
+    Imported tweets keep their relative ids: each one is stored as
+    ``id + offset``, where ``offset`` is the highest id ever used here, and
+    ``replying_to``/``quoting_tweet_id`` are shifted the same way. The whole
+    id range is reserved first, so tweets posted during the import can't
+    take an id an imported tweet needs. Every IMPORT_BATCH tweets or usage
+    rows are then committed on their own, and the write lock is never held
+    while the next batch is read; if a later line is malformed, the batches
+    before it stay imported.
+
+    ``defer_indexes`` is for offline bulk loads. It drops the secondary
+    indexes and the search-index trigger and rebuilds them once at the end,
+    with all of it, tweets included, in one tweets.db transaction. Readers
+    keep seeing the indexed snapshot until it commits, but other writers
+    wait for the whole import, and a malformed line rolls every tweet back.
+    Token usage is still committed in batches.
+
+    Returns a summary dict and raises ValueError on a malformed line. A
+    duplicate id is reported at the last line of the batch it was in.
+    """
+    summary = {'tweets': 0, 'token_usage': 0, 'skipped': 0, 'id_offset': None}
+    tweets, usage = [], []
+    numbered = ((line_no, line) for line_no, line in enumerate(lines, 1) if line.strip())
+    line_no, line = next(numbered, (1, ''))
+    try:
+        meta = json.loads(line)
+        max_id = int(meta.get('tweets_max_id') or 0) if meta.get('type') == 'meta' else None
+    except (AttributeError, TypeError, ValueError):
+        max_id = None
+    if max_id is None:
+        raise ValueError(f'Line {line_no}: expected the meta record that starts an export')
+
+    with db.connect(DB_FILE) as conn, db.connect(PROMPT_DB_FILE) as prompts_conn:
+        def flush_tweets():
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                f"INSERT INTO tweets ({', '.join(TWEET_EXPORT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)", tweets)
+            if not defer_indexes:
+                conn.commit()
+            summary['tweets'] += len(tweets)
+            tweets.clear()
+
+        def flush_usage():
+            with prompts_conn:
+                prompts_conn.executemany(
+                    f"INSERT INTO token_usage ({', '.join(USAGE_EXPORT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)", usage)
+            summary['token_usage'] += len(usage)
+            usage.clear()
+
+        conn.execute('BEGIN IMMEDIATE')
+        offset = summary['id_offset'] = last_tweet_id(conn)
+        if not conn.execute("UPDATE sqlite_sequence SET seq=? WHERE name='tweets'", (offset + max_id,)).rowcount:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('tweets', ?)", (offset + max_id,))
+        if defer_indexes:
+            for name in TWEET_INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            conn.execute('DROP TRIGGER IF EXISTS tweets_fts_insert')
+        else:
+            conn.commit()
+        try:
+            for line_no, line in numbered:
+                try:
+                    record = json.loads(line)
+                    kind = record.get('type')
+                    if kind == 'tweet':
+                        tweet_id = int(record['id'])
+                        if not 1 <= tweet_id <= max_id:
+                            raise ValueError(f'id {tweet_id} is outside the exported range 1..{max_id}')
+                        for key in ('username', 'text', 'timestamp'):
+                            if not isinstance(record.get(key), str):
+                                raise ValueError(f'{key} must be a string')
+                        tweets.append((
+                            tweet_id + offset,
+                            record['username'],
+                            record['text'],
+                            record['timestamp'],
+                            int(record['replying_to']) + offset if record.get('replying_to') else None,
+                            int(record['quoting_tweet_id']) + offset if record.get('quoting_tweet_id') else None,
+                            int(record.get('like_count') or 0),
+                        ))
+                    elif kind == 'token_usage':
+                        usage.append(tuple(record.get(column) for column in USAGE_EXPORT_COLUMNS))
+                        if not record.get('timestamp'):
+                            raise KeyError('timestamp')
+                    else:
+                        summary['skipped'] += 1
+                    if len(tweets) >= IMPORT_BATCH:
+                        flush_tweets()
+                    if len(usage) >= IMPORT_BATCH:
+                        flush_usage()
+                # IntegrityError covers ids duplicated within the import
+                except (AttributeError, KeyError, TypeError, ValueError, sqlite3.IntegrityError) as e:
+                    raise ValueError(f'Line {line_no}: invalid record ({e})') from e
+            try:
+                if tweets:
+                    flush_tweets()
+                if usage:
+                    flush_usage()
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f'Line {line_no}: invalid record ({e})') from e
+            if defer_indexes:
+                for statement in TWEET_INDEXES.values():
+                    conn.execute(statement)
+                conn.execute(FTS_INSERT_TRIGGER)
+                # Index the tweets added while the trigger was gone
+                conn.execute(
+                    'INSERT INTO tweets_fts (rowid, text, username) SELECT id, text, username FROM tweets WHERE id > ?',
+                    (offset,),
+                )
+                conn.commit()
+        except Exception:
+            # With defer_indexes this also restores the dropped indexes
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    publish_changes()
+    return summary
+
+ARCHIVE_COLUMNS = TWEET_EXPORT_COLUMNS + ('trend_score',)
+
+def days_ago(days):
+    return (datetime.datetime.utcnow() - datetime.timedelta(days=days)).isoformat() + 'Z'
+
+@metrics.timed_query(rows=lambda result: result['archived'] + result['purged'])
+def archive_tweets(hot_tweets=ARCHIVE_HOT_TWEETS, after_days=ARCHIVE_AFTER_DAYS,
+                   retention_days=ARCHIVE_RETENTION_DAYS, batch=ARCHIVE_BATCH):
+    """Apply the archival policy and return {'archived': n, 'purged': n}.
+
+    Tweets more than ``hot_tweets`` ids behind the newest one or older
+    than ``after_days`` move to the archive, then archived tweets older
+    than ``retention_days`` are deleted. A rule set to 0 is skipped. Each
+    transaction handles at most ``batch`` tweets, so writers never wait
+    long.
+
+    A batch moves in three transactions that each write one database
+    file, since SQLite only commits atomically per file: its ids are
+    staged in archive_pending, copied into the archive, then deleted from
+    the hot table, skipping any that aren't in the archive yet. A crash
+    leaves the batch staged, or in both tables, and the next run finishes
+    it. Staged ids keep their deletes out of the change log, as clients
+    read the same tweets from the archive.
+    """
+    summary = {'archived': 0, 'purged': 0}
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    cutoff = days_ago(after_days) if after_days else ''
+
+    @db.retry_on_busy
+    def stage_batch():
+        """Stage the next batch; False when one was left over from an
+        interrupted run, which then goes first."""
+        with db.transaction(DB_FILE) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM archive_pending LIMIT 1').fetchone():
+                return False
+            max_id = last_tweet_id(conn) - hot_tweets if hot_tweets else 0
+            conn.execute(
+                'INSERT INTO archive_pending (id)'
+                ' SELECT id FROM tweets WHERE id <= ? UNION SELECT id FROM tweets WHERE timestamp < ? LIMIT ?',
+                (max_id, cutoff, batch),
+            )
+            return True
+
+    @db.retry_on_busy
+    def copy_batch():
+        with db.transaction(DB_FILE) as conn:
+            conn.execute(
+                f'INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.tweets ({columns})'
+                f' SELECT {columns} FROM tweets WHERE id IN (SELECT id FROM archive_pending)'
+            )
+
+    @db.retry_on_busy
+    def delete_batch():
+        with db.transaction(DB_FILE) as conn:
+            moved = conn.execute(
+                'DELETE FROM tweets WHERE id IN'
+                f' (SELECT id FROM archive_pending WHERE id IN (SELECT id FROM {ARCHIVE_SCHEMA}.tweets))'
+            ).rowcount
+            conn.execute('DELETE FROM archive_pending WHERE id NOT IN (SELECT id FROM tweets)')
+            return moved
+
+    @db.retry_on_busy
+    def purge_batch():
+        with db.transaction(DB_FILE) as conn:
+            return conn.execute(
+                f'DELETE FROM {ARCHIVE_SCHEMA}.tweets WHERE id IN'
+                f' (SELECT id FROM {ARCHIVE_SCHEMA}.tweets WHERE timestamp < ? LIMIT ?)',
+                (days_ago(retention_days), batch),
+            ).rowcount
+
+    if hot_tweets or after_days:
+        while True:
+            staged = stage_batch()
+            copy_batch()
+            moved = delete_batch()
+            summary['archived'] += moved
+            if staged and moved < batch:
+                break
+    if retention_days:
+        while (purged := purge_batch()):
+            summary['purged'] += purged
+            if purged < batch:
+                break
+    if summary['purged']:
+        publish_changes()
+    return summary
+
+@metrics.timed_query(rows=lambda result: 1)
+def load_archive_stats():
+    with db.connect(DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+        stats = {}
+        for name, table in zip(('hot', 'archived'), TWEET_TABLES):
+            cur.execute(f'SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM {table}')
+            count, oldest, newest = cur.fetchone()
+            stats[name] = {'tweets': count, 'oldest': oldest, 'newest': newest}
+    return stats
+
+def start_archiver(interval=ARCHIVE_INTERVAL_SECONDS):
+    """Apply the archival policy every ``interval`` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                archive_tweets()
+            except Exception as e:
+                print(f"ERROR: Archiving failed. {e}")
+    threading.Thread(target=run, name='archiver', daemon=True).start()
+
+def publish_changes():
+    """Push everything written since the last publish to stream subscribers.
+
+    Events are published under the lock, so subscribers get them in cursor
+    order; a stream drops any event at or below the cursor it has sent.
+    Publishing only appends to each subscriber's buffer.
+    """
+    global _published_cursor
+    with _publish_lock:
+        since = _published_cursor
+        if not broker.subscriber_count():
+            with db.connect(DB_FILE) as conn:
+                _published_cursor = current_change_cursor(conn.cursor())
+            return
+        cursor, tweets, deleted_ids = load_changes(since)
+        if cursor == since:
+            return
+        _published_cursor = cursor
+        if tweets is None:
+            broker.publish(cursor, ('resync', {'cursor': cursor}))
+        else:
+            broker.publish(cursor, ('delta', {'since': since, 'cursor': cursor, 'tweets': tweets, 'deleted': deleted_ids}))
+
+def start_change_poller():
+    """Publish changes committed by other processes to this process's
+    stream subscribers. Each process only publishes its own writes, so with
+    several workers this polls the change-log cursor while anyone is
+    subscribed here."""
+    global _change_poller
+    with _publish_lock:
+        if _change_poller is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(STREAM_POLL_SECONDS)
+                if not broker.subscriber_count():
+                    continue
+                try:
+                    with db.connect(DB_FILE) as conn:
+                        cursor = current_change_cursor(conn.cursor())
+                    if cursor != _published_cursor:
+                        publish_changes()
+                except Exception as e:
+                    print(f"ERROR: Change poll failed. {e}")
+        _change_poller = threading.Thread(target=run, name='change-poller', daemon=True)
+        _change_poller.start()
+
+def create_tweet(username, text, replying_to=None, quoting_tweet_id=None):
+    """Insert a new tweet, notify stream subscribers and return it."""
+    new_tweet = {
+        'username': username,
+        'text': text,
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'replying_to': replying_to,
+        'quoting_tweet_id': quoting_tweet_id,
+        'like_count': 0,
+    }
+    new_tweet['id'] = insert_tweet(new_tweet)
+    publish_changes()
+    return new_tweet
+
+def create_tweets(posts):
+    """Insert several tweets in one transaction and notify stream
+    subscribers once. ``posts`` are dicts with ``username``, ``text`` and
+    optional ``replying_to``/``quoting_tweet_id``, which may be ``"$N"``
+    references to earlier posts in the list. Returns the new tweets."""
+    timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
+    new_tweets = [
+        {
+            'username': post['username'],
+            'text': post['text'],
+            'timestamp': timestamp,
+            'replying_to': post.get('replying_to'),
+            'quoting_tweet_id': post.get('quoting_tweet_id'),
+            'like_count': 0,
+        }
+        for post in posts
+    ]
+    ids = insert_tweets(new_tweets)
+    for tweet, tweet_id in zip(new_tweets, ids):
+        tweet['id'] = tweet_id
+        for key in ('replying_to', 'quoting_tweet_id'):
+            index = batch_ref_index(tweet[key])
+            if index is not None:
+                tweet[key] = ids[index]
+    publish_changes()
+    return new_tweets
+
+class LocalTimeline:
+    """Bot timeline backend that reads and writes tweets.db in-process,
+    so bots started from the app skip the HTTP round-trip to itself. Their
+    token usage is queued on ``writer`` with the app's own."""
+
+    def latest_tweets(self, limit):
+        return load_tweets(limit=limit, fields=llm_bot.CONTEXT_FIELDS)
+
+    def trending_tweets(self, limit):
+        return load_trending(limit, llm_bot.CONTEXT_FIELDS)
+
+    def post(self, username, payload):
+        print(f"Posting to LAN Twitter: {payload}")
+        return create_tweet(
+            username,
+            payload['text'],
+            payload.get('replying_to'),
+            payload.get('quoting_tweet_id'),
+        )
+
+    def post_batch(self, posts):
+        print(f"Posting {len(posts)} tweets to LAN Twitter")
+        return create_tweets(posts)
+
+    def log_token_usage(self, prompt_tokens, completion_tokens, total_tokens, persona):
+        log_token_usage(prompt_tokens, completion_tokens, total_tokens, persona)
+
+http_request_seconds = metrics.histogram(
+    'lan_twitter_http_request_seconds', 'Time to build each API response.', ('route', 'method', 'status'))
+http_response_bytes = metrics.histogram(
+    'lan_twitter_http_response_bytes', 'Size of each response body.', ('route', 'method'), metrics.SIZE_BUCKETS)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by URL rule rather than path so /api/tweets/<id> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_request_seconds.observe(
+        time.perf_counter() - g.request_started,
+        route=route, method=request.method, status=response.status_code,
+    )
+    if not response.is_streamed:
+        http_response_bytes.observe(response.calculate_content_length() or 0, route=route, method=request.method)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress text responses for clients that accept br or gzip."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def tweets_version():
+    """Return the ETag for everything the tweet endpoints serve.
+
+    The version is the change-log cursor, which every insert, update and
+    delete advances, plus the count of likes queued in the write-behind
+    buffer that reads already include. Reading it is a single index lookup.
+    That buffer belongs to this process, so once it has been used the
+    version is tagged with the pid and other workers won't match it.
+    """
+    with db.connect(DB_FILE) as conn:
+        version = str(current_change_cursor(conn.cursor()))
+    if writer.like_generation:
+        version += f".{os.getpid()}.{writer.like_generation}"
+    return version
+
+def conditional_on_tweets(view):
+    """Answer 304 when the client's ETag still matches the tweets version,
+    before the view runs any query.
+
+    There is no Last-Modified: a whole-second date can't tell apart changes
+    made within the same second, so only the ETag is used for validation.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = tweets_version()
+        if request.if_none_match and request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def requested_fields():
+    """Parse ``?fields=id,username,text`` into a tuple of TWEET_FIELDS, or
+    None when every field is wanted. Raises ValueError for unknown names."""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in TWEET_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"fields must be a comma-separated list of {', '.join(TWEET_FIELDS)}")
+    return fields
 
 @app.route('/api/tweets', methods=['GET'])
+@conditional_on_tweets
 def get_tweets():
-    all_tweets = load_tweets()
-    all_tweets_with_counts = add_interaction_counts(all_tweets)
-    
+    """List tweets, newest first.
+
+    ``?limit=N`` returns one page of the main feed with side-loaded
+    ``included`` tweets and a ``next`` cursor to pass as ``?before=``.
+    ``?replying_to=`` / ``?quoting=`` list replies to or quotes of a tweet,
+    ``?since=`` returns changes for pollers, and no parameters returns the
+    whole timeline. ``?fields=`` trims every tweet to the listed fields.
+    """
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, FEED_PAGE_LIMIT))
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return get_tweet_changes(since, limit, fields)
+
     replying_to_id = request.args.get('replying_to', type=int)
     quoting_id = request.args.get('quoting', type=int)
-    
-    if replying_to_id:
-        filtered_tweets = [t for t in all_tweets_with_counts if t.get('replying_to') == replying_to_id]
-    elif quoting_id:
-        filtered_tweets = [t for t in all_tweets_with_counts if t.get('quoting_tweet_id') == quoting_id]
-    else:
-        filtered_tweets = all_tweets_with_counts
+    if limit and not (replying_to_id or quoting_id):
+        before = None
+        if request.args.get('before'):
+            timestamp, _, before_id = request.args['before'].rpartition('|')
+            if not timestamp or not before_id.isdigit():
+                return jsonify({'error': 'Invalid cursor'}), 400
+            before = (timestamp, int(before_id))
+        return feed_page_response(limit, before, fields)
+    tweets = load_tweets(replying_to=replying_to_id, quoting=quoting_id, limit=limit, fields=fields)
+    return jsonify(project_tweets(tweets, fields))
+
+def get_tweet_changes(since, limit=None, fields=None):
+    """Delta mode for pollers: tweets added or updated after ``since``.
 
-    return jsonify(sorted(filtered_tweets, key=lambda t: t['timestamp'], reverse=True))
+    ``since`` is the ``cursor`` returned by the previous call (0 for the first
+    one). When the cursor is too old ``full`` is true and the client should
+    replace its cache: with ``limit`` the response is the first feed page,
+    otherwise a full snapshot.
+    """
+    cursor, tweets, deleted_ids = load_changes(since, fields)
+    if tweets is None:
+        if limit:
+            return feed_page_response(limit, fields=fields, full=True, deleted=[])
+        cursor, tweets = load_tweets_snapshot(fields)
+        return jsonify({'cursor': cursor, 'full': True, 'tweets': project_tweets(tweets, fields), 'deleted': []})
+    return jsonify({'cursor': cursor, 'full': False, 'tweets': project_tweets(tweets, fields), 'deleted': deleted_ids})
 
 @app.route('/api/tweets/<int:tweet_id>', methods=['GET'])
+@conditional_on_tweets
 def get_tweet_by_id(tweet_id):
-    all_tweets = load_tweets()
-    all_tweets_with_counts = add_interaction_counts(all_tweets)
-    tweet = next((t for t in all_tweets_with_counts if t.get('id') == tweet_id), None)
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    tweet = get_tweet(tweet_id, fields)
     if tweet:
-        return jsonify(tweet)
+        return jsonify(project_tweets([tweet], fields)[0])
     return jsonify({'error': 'Tweet not found'}), 404
 
+@app.route('/api/tweets/<int:tweet_id>/thread', methods=['GET'])
+@conditional_on_tweets
+def get_thread(tweet_id):
+    """The whole conversation around a tweet in one bounded query.
+
+    ``?max_depth=`` and ``?max_nodes=`` bound how far up and down the reply
+    chain the walk goes. ``?fields=`` applies to every tweet; replies keep
+    their ``depth``.
+    """
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    tweet = get_tweet(tweet_id, fields)
+    if not tweet:
+        return jsonify({'error': 'Tweet not found'}), 404
+    max_depth = max(0, min(request.args.get('max_depth', THREAD_MAX_DEPTH, type=int), THREAD_DEPTH_LIMIT))
+    max_nodes = max(1, min(request.args.get('max_nodes', THREAD_MAX_NODES, type=int), THREAD_NODE_LIMIT))
+    ancestors, replies, truncated = load_thread(tweet_id, max_depth, max_nodes, fields)
+    counts = {
+        'ancestors': len(ancestors),
+        'replies': len(replies),
+        'max_depth': max((r['depth'] for r in replies), default=0),
+        'truncated': truncated,
+    }
+    return jsonify({
+        'tweet': project_tweets([tweet], fields)[0],
+        'ancestors': project_tweets(ancestors, fields, ('depth',)),
+        'replies': project_tweets(replies, fields, ('depth',)),
+        'counts': counts,
+    })
+
 @app.route('/api/tweets/<int:tweet_id>', methods=['DELETE'])
 def delete_tweet(tweet_id):
     if delete_tweet_db(tweet_id):
+        publish_changes()
         return jsonify({'status': 'deleted'})
     return jsonify({'error': 'Tweet not found'}), 404
 
@@ -260,18 +1535,48 @@ def post_tweet():
     if not tweet_data or 'username' not in tweet_data or 'text' not in tweet_data:
         return jsonify({'error': 'Missing data'}), 400
 
-    new_tweet = {
-        'username': tweet_data['username'],
-        'text': tweet_data['text'],
-        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
-        'replying_to': tweet_data.get('replying_to', None),
-        'quoting_tweet_id': tweet_data.get('quoting_tweet_id', None),
-        'like_count': 0,
-    }
-
-    new_tweet['id'] = insert_tweet(new_tweet)
+    new_tweet = create_tweet(
+        tweet_data['username'],
+        tweet_data['text'],
+        tweet_data.get('replying_to', None),
+        tweet_data.get('quoting_tweet_id', None),
+    )
     return jsonify(new_tweet), 201
 
+def validate_tweet_batch(posts):
+    """Return an error message for the first invalid post, or None."""
+    if not isinstance(posts, list) or not posts:
+        return 'Expected a non-empty JSON array of tweets'
+    if len(posts) > TWEET_BATCH_LIMIT:
+        return f'At most {TWEET_BATCH_LIMIT} tweets per batch'
+    for i, post in enumerate(posts):
+        if not isinstance(post, dict) or not isinstance(post.get('username'), str) \
+                or not isinstance(post.get('text'), str):
+            return f'Tweet {i}: username and text are required'
+        for key in ('replying_to', 'quoting_tweet_id'):
+            ref = post.get(key)
+            if ref is None or (isinstance(ref, int) and not isinstance(ref, bool) and ref > 0):
+                continue
+            index = batch_ref_index(ref)
+            if index is None or index >= i:
+                return f'Tweet {i}: {key} must be a tweet id or "$N" for an earlier tweet in the batch'
+    return None
+
+@app.route('/api/tweets/batch', methods=['POST'])
+def post_tweet_batch():
+    """Create a JSON array of tweets in one transaction.
+
+    Each item takes the same fields as ``POST /api/tweets``; ``replying_to``
+    and ``quoting_tweet_id`` may also be ``"$N"`` to refer to the N-th tweet
+    earlier in the same array. Returns the ids in order and the new tweets.
+    """
+    posts = request.get_json(silent=True)
+    error = validate_tweet_batch(posts)
+    if error:
+        return jsonify({'error': error}), 400
+    new_tweets = create_tweets(posts)
+    return jsonify({'ids': [t['id'] for t in new_tweets], 'tweets': new_tweets}), 201
+
 @app.route('/api/tweets/<int:tweet_id>/like', methods=['POST'])
 def like_tweet(tweet_id):
     """New endpoint to increment a tweet's like count."""
@@ -279,11 +1584,156 @@ def like_tweet(tweet_id):
     if not tweet:
         return jsonify({'error': 'Tweet not found'}), 404
 
-    increment_like(tweet_id)
-    updated_tweet = get_tweet(tweet_id)
+    # Queued rather than committed here; stream subscribers hear about it
+    # once the write-behind batch lands
+    writer.add_like(tweet_id)
+    tweet['like_count'] = (tweet['like_count'] or 0) + 1
+    return jsonify(tweet)
+
+def format_event(event_type, event_id, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Server-sent events carrying the same deltas as ``?since=`` polling.
+
+    Event ids are change-log cursors, so a reconnecting client's
+    ``Last-Event-ID`` (or ``?last_event_id=`` on first connect) resumes from
+    where it left off. A ``resync`` event means the client missed changes and
+    should fetch a fresh snapshot. When the process already serves
+    STREAM_MAX_SUBSCRIBERS streams the answer is 503, and the client polls.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    # Subscribe before catching up so nothing published in between is lost
+    sub = broker.subscribe()
+    if sub is None:
+        response = jsonify({'error': 'Too many event streams; poll /api/tweets?since= instead'})
+        response.headers['Retry-After'] = str(STREAM_RETRY_SECONDS)
+        return response, 503
+    start_change_poller()
+
+    def generate():
+        try:
+            cursor = last_id
+            yield 'retry: 2000\n\n'
+            if last_id is not None:
+                cursor, tweets, deleted_ids = load_changes(last_id)
+                if tweets is None:
+                    yield format_event('resync', cursor, {'cursor': cursor})
+                elif tweets or deleted_ids:
+                    yield format_event('delta', cursor, {'since': last_id, 'cursor': cursor, 'tweets': tweets, 'deleted': deleted_ids})
+            while True:
+                event = sub.get(STREAM_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif event == 'overflow':
+                    yield format_event('resync', cursor or 0, {'cursor': cursor})
+                else:
+                    event_id, (event_type, data) = event
+                    if cursor is not None and event_id <= cursor:
+                        continue
+                    cursor = event_id
+                    yield format_event(event_type, event_id, data)
+        finally:
+            broker.unsubscribe(sub)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/search', methods=['GET'])
+@conditional_on_tweets
+def search():
+    """Full-text search. Pass the returned ``next`` as ``?after=`` for the
+    next page. ``?fields=`` trims the tweets; ``snippet`` and ``rank`` are
+    always included."""
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = fts_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 100))
+    after = None
+    if request.args.get('after'):
+        try:
+            rank, tweet_id = request.args['after'].split(':')
+            after = (float(rank), int(tweet_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    results = search_tweets(query, limit, after, fields)
+    next_cursor = None
+    if len(results) == limit:
+        last = results[-1]
+        next_cursor = f"{last['rank']!r}:{last['id']}"
+    return jsonify({'results': project_tweets(results, fields, ('snippet', 'rank')), 'next': next_cursor})
+
+@app.route('/api/trending', methods=['GET'])
+def get_trending():
+    """The ``?limit=`` (default 20) tweets with the most recent engagement.
+    ``?fields=`` trims the tweets; ``trend`` is always included."""
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = request.args.get('limit', default=TRENDING_PAGE_SIZE, type=int)
+    tweets = load_trending(max(1, min(limit, TRENDING_PAGE_LIMIT)), fields)
+    return jsonify(project_tweets(tweets, fields, ('trend',)))
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """Stream tweets and token usage as NDJSON. ``?tables=tweets`` or
+    ``?tables=token_usage`` limits the export to one table."""
+    tables = tuple(request.args.get('tables', 'tweets,token_usage').split(','))
+    if not set(tables) <= {'tweets', 'token_usage'}:
+        return jsonify({'error': 'tables must be tweets and/or token_usage'}), 400
+    response = Response(export_ndjson(tables), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=lan_twitter_export.ndjson'
+    return response
+
+@app.route('/api/import', methods=['POST'])
+def import_data():
+    """Append the NDJSON produced by ``/api/export``, read line by line
+    from the request stream. ``?defer_indexes=1`` rebuilds the indexes once
+    at the end instead of maintaining them per row; it blocks other writers
+    for the whole upload, so it is refused while stream clients are
+    connected."""
+    defer_indexes = request.args.get('defer_indexes', '').lower() in ('1', 'true', 'yes')
+    if defer_indexes and broker.subscriber_count():
+        return jsonify({'error': 'defer_indexes is for offline imports, and stream clients are connected'}), 409
+    try:
+        summary = import_ndjson(request.stream, defer_indexes=defer_indexes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(summary)
+
+def archive_policy():
+    return {'hot_tweets': ARCHIVE_HOT_TWEETS, 'after_days': ARCHIVE_AFTER_DAYS, 'retention_days': ARCHIVE_RETENTION_DAYS}
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive():
+    """Tweet counts and time ranges of the hot table and the archive."""
+    return jsonify({**load_archive_stats(), 'policy': archive_policy()})
 
-    tweet_with_counts = add_interaction_counts([updated_tweet])[0]
-    return jsonify(tweet_with_counts)
+@app.route('/api/archive', methods=['POST'])
+def run_archive():
+    """Archive and purge now. The JSON body may override any policy value
+    for this run, e.g. ``{"after_days": 1}``."""
+    data = request.get_json(silent=True) or {}
+    policy = archive_policy()
+    for key in policy:
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return jsonify({'error': f'{key} must be a non-negative number'}), 400
+            policy[key] = value
+    policy['hot_tweets'] = int(policy['hot_tweets'])
+    return jsonify(archive_tweets(**policy))
 
 @app.route('/api/personas', methods=['GET'])
 def get_personas():
@@ -294,18 +1744,14 @@ def add_persona():
     data = request.get_json()
     if not data or 'name' not in data or 'prompt' not in data:
         return jsonify({'error': 'Missing data'}), 400
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
     try:
-        cur.execute(
-            "INSERT INTO personas (name, prompt) VALUES (?, ?)",
-            (data['name'], data['prompt']),
-        )
-        conn.commit()
+        with db.transaction(PROMPT_DB_FILE) as conn:
+            conn.execute(
+                "INSERT INTO personas (name, prompt) VALUES (?, ?)",
+                (data['name'], data['prompt']),
+            )
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Persona already exists'}), 400
-    conn.close()
     return jsonify({'status': 'added'}), 201
 
 @app.route('/api/personas/<string:name>', methods=['PUT'])
@@ -313,33 +1759,24 @@ def update_persona(name):
     data = request.get_json()
     if not data or 'name' not in data or 'prompt' not in data:
         return jsonify({'error': 'Missing data'}), 400
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
     try:
-        cur.execute(
-            "UPDATE personas SET name=?, prompt=? WHERE name=?",
-            (data['name'], data['prompt'], name),
-        )
-        if cur.rowcount == 0:
-            conn.close()
-            return jsonify({'error': 'Persona not found'}), 404
-        conn.commit()
+        with db.transaction(PROMPT_DB_FILE) as conn:
+            cur = conn.execute(
+                "UPDATE personas SET name=?, prompt=? WHERE name=?",
+                (data['name'], data['prompt'], name),
+            )
+            if cur.rowcount == 0:
+                return jsonify({'error': 'Persona not found'}), 404
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Persona with that name already exists'}), 400
-    conn.close()
     return jsonify({'status': 'updated'})
 
 @app.route('/api/personas/<string:name>', methods=['DELETE'])
 def delete_persona(name):
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM personas WHERE name=?", (name,))
-    conn.commit()
-    if cur.rowcount == 0:
-        conn.close()
-        return jsonify({'error': 'Persona not found'}), 404
-    conn.close()
+    with db.transaction(PROMPT_DB_FILE) as conn:
+        cur = conn.execute("DELETE FROM personas WHERE name=?", (name,))
+        if cur.rowcount == 0:
+            return jsonify({'error': 'Persona not found'}), 404
     return jsonify({'status': 'deleted'})
 
 @app.route('/api/system_prompt', methods=['GET'])
@@ -356,35 +1793,190 @@ def set_system_prompt():
 
 @app.route('/api/token_usage', methods=['GET'])
 def get_token_usage():
-    return jsonify(load_token_usage())
+    """One page of raw usage rows. Pass the returned ``next_before_id`` as
+    ``?before_id=`` to fetch the next (older) page."""
+    limit = max(1, min(request.args.get('limit', TOKEN_USAGE_PAGE_SIZE, type=int), 1000))
+    before_id = request.args.get('before_id', type=int)
+    rows = load_token_usage(limit, before_id)
+    next_before_id = rows[-1]['id'] if len(rows) == limit else None
+    return jsonify({'usage': rows, 'next_before_id': next_before_id})
+
+@app.route('/api/token_usage/summary', methods=['GET'])
+def get_token_usage_summary():
+    return jsonify(load_token_usage_summary())
 
+@app.route('/api/token_usage/buckets', methods=['GET'])
+def get_token_usage_buckets():
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in ('hour', 'day'):
+        return jsonify({'error': "bucket must be 'hour' or 'day'"}), 400
+    limit = max(1, min(request.args.get('limit', 48, type=int), 1000))
+    return jsonify(load_token_usage_buckets(bucket, limit))
+
+
+local_timeline = LocalTimeline()
+bot_scheduler = bot_jobs.BotScheduler({
+    'single': lambda: llm_bot.run_bot(local_timeline),
+    'round': lambda: llm_bot.run_round(local_timeline),
+})
 
 @app.route('/api/run_bot', methods=['POST'])
 def trigger_bot():
-    """Start a single LLM bot cycle in a background thread."""
-    Thread(target=llm_bot.run_bot).start()
-    return jsonify({'status': 'running'}), 202
+    """Queue LLM bot cycles on the worker pool.
+
+    An optional JSON body ``{"cycles": N}`` runs N cycles back to back as a
+    single job, and ``{"mode": "round"}`` lets every persona act in each
+    cycle instead of one random persona. Returns 429 when the queue is full.
+    """
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'single')
+    if mode not in bot_scheduler.modes:
+        return jsonify({'error': f'Unknown mode {mode!r}'}), 400
+    cycles = data.get('cycles', 1)
+    if isinstance(cycles, bool) or not isinstance(cycles, int) or not 1 <= cycles <= bot_jobs.MAX_CYCLES_PER_JOB:
+        return jsonify({'error': f'cycles must be between 1 and {bot_jobs.MAX_CYCLES_PER_JOB}'}), 400
+    try:
+        job = bot_scheduler.submit(mode, cycles)
+    except bot_jobs.QueueFull:
+        response = jsonify({'error': 'Bot queue is full'})
+        response.headers['Retry-After'] = '2'
+        return response, 429
+    return jsonify({'status': 'queued', 'job_id': job.id, 'mode': mode, 'cycles': cycles}), 202
+
+@app.route('/api/bot_jobs/<int:job_id>', methods=['GET'])
+def get_bot_job(job_id):
+    job = bot_scheduler.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+metrics.gauge('lan_twitter_bot_queue_depth', 'Bot jobs waiting for a worker.', callback=lambda: bot_scheduler.queue_depth())
+metrics.gauge('lan_twitter_bot_jobs_running', 'Bot jobs currently running.', callback=lambda: bot_scheduler.running)
+metrics.gauge('lan_twitter_threads', 'Live threads in the server process.', callback=threading.active_count)
+metrics.gauge('lan_twitter_stream_subscribers', 'Open /api/stream connections.', callback=lambda: broker.subscriber_count())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiler', methods=['GET'])
+def get_profiler():
+    """Stacks sampled so far, most frequent first.
+
+    ``?format=collapsed`` returns them as flame graph input instead of JSON,
+    and ``?top=N`` limits the JSON to the N most frequent stacks.
+    """
+    if request.args.get('format') == 'collapsed':
+        return Response(metrics.profiler.collapsed(), mimetype='text/plain')
+    return jsonify(metrics.profiler.snapshot(request.args.get('top', default=50, type=int)))
+
+@app.route('/api/profiler', methods=['POST'])
+def set_profiler():
+    """Start or stop the sampling profiler.
+
+    Body: ``{"enabled": true, "interval": 0.005, "reset": true}``; every key
+    is optional.
+    """
+    data = request.get_json(silent=True) or {}
+    interval = data.get('interval')
+    if interval is not None and (not isinstance(interval, (int, float)) or not 0.001 <= interval <= 1):
+        return jsonify({'error': 'interval must be between 0.001 and 1 seconds'}), 400
+    if data.get('reset'):
+        metrics.profiler.reset()
+    if data.get('enabled') is True:
+        metrics.profiler.start(interval)
+    elif data.get('enabled') is False:
+        metrics.profiler.stop()
+    return jsonify({'running': metrics.profiler.running, 'interval': metrics.profiler.interval})
+
+# Script and stylesheet references in the HTML pages
+ASSET_REF = re.compile(r'((?:src|href)=")([\w-]+\.(?:js|css))(")')
+
+@functools.lru_cache(maxsize=64)
+def _asset_version(filename, mtime):
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+def asset_version(filename):
+    return _asset_version(filename, os.path.getmtime(os.path.join(app.static_folder, filename)))
+
+def serve_page(filename):
+    """Serve an HTML page with its assets pinned to their content hash.
+
+    Pages are revalidated on every load, while ``script.js?v=<hash>`` can be
+    cached for a year and is refetched only once its content changes.
+    """
+    with open(os.path.join(app.static_folder, filename), encoding='utf-8') as f:
+        html = ASSET_REF.sub(lambda m: f'{m[1]}{m[2]}?v={asset_version(m[2])}{m[3]}', f.read())
+    response = Response(html, mimetype='text/html')
+    response.set_etag(hashlib.sha1(html.encode()).hexdigest())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/')
 def serve_index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_page('index.html')
 
 @app.route('/prompts')
 def serve_prompts():
-    return send_from_directory(app.static_folder, 'prompts.html')
+    return serve_page('prompts.html')
 
 @app.route('/tokens')
 def serve_tokens():
-    return send_from_directory(app.static_folder, 'tokens.html')
+    return serve_page('tokens.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory(app.static_folder, path)
+    page = safe_join(app.static_folder, path)
+    if path.endswith('.html') and page and os.path.isfile(page):
+        return serve_page(path)
+    if request.args.get('v'):
+        response = send_from_directory(app.static_folder, path, max_age=STATIC_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    return send_from_directory(app.static_folder, path, max_age=0)
+
+_init_lock = Lock()
+_schema_ready = False
+_process_ready = False
+
+def init_schema():
+    """Create or migrate tweets.db, the archive and prompts.db. Run once at
+    startup, before any worker processes are forked."""
+    global _schema_ready
+    with _init_lock:
+        if not _schema_ready:
+            init_db()
+            init_prompt_db()
+            _schema_ready = True
+
+def init_process(archiver=ARCHIVE_INTERVAL_SECONDS > 0):
+    """Per-process startup, after the schema exists: stream events start
+    from the current change cursor, and ``archiver`` starts the archival
+    thread. With several workers only one of them should run it."""
+    global _process_ready, _published_cursor
+    with _init_lock:
+        if _process_ready:
+            return
+        with db.connect(DB_FILE) as conn:
+            _published_cursor = current_change_cursor(conn.cursor())
+        if archiver:
+            start_archiver()
+        _process_ready = True
+
+def init_app():
+    """Everything a single-process server or script needs before it uses
+    the data functions. Safe to call more than once."""
+    init_schema()
+    init_process()
 
-# Ensure the database schema exists when the application starts
-init_db()
-init_prompt_db()
-SYSTEM_INSTRUCTIONS = load_system_prompt()
+@app.before_request
+def ensure_initialized():
+    # Covers WSGI servers started without gunicorn.conf.py's hooks
+    if not _process_ready:
+        init_app()
 
 if __name__ == '__main__':
+    # Development server; run `gunicorn app:app` in production
+    init_schema()
     app.run(host='0.0.0.0', port=5001, debug=True)
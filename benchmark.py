@@ -0,0 +1,434 @@
+# benchmark.py
+"""Load-test the LAN Twitter API against a synthetic corpus.
+
+Generates tweets.db/prompts.db with a realistic reply/quote graph, serves the
+app in-process with bots pointed at a local stub LLM, hammers the endpoints
+with concurrent simulated clients and prints per-endpoint latency,
+throughput and memory as JSON:
+
+    python benchmark.py --tweets 100000 --concurrency 16 --duration 10 -o bench.json
+
+Results from two commits can be compared with ``--compare old.json``.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+SCENARIOS = ('poll', 'feed', 'tweet', 'like', 'run_bot')
+USERNAMES = 500
+REPLY_RATIO = 0.35
+QUOTE_RATIO = 0.10
+# Synthetic token-usage rows per tweet in prompts.db
+USAGE_PER_TWEET = 0.1
+INSERT_BATCH = 10000
+FEED_PAGE = 50
+WORDS = (
+    'lan', 'twitter', 'bot', 'rome', 'viking', 'sunstone', 'cat', 'nap', 'future',
+    'robots', 'history', 'coffee', 'monday', 'sqlite', 'index', 'query', 'latency',
+    'optimism', 'grumpy', 'fact', 'empire', 'network', 'packet', 'cache', 'hello',
+)
+
+
+# --- Synthetic corpus ---
+
+def _pick_target(rng, popular, newest_id):
+    """Choose a tweet to reply to or quote.
+
+    Half the time it is a recent tweet, and otherwise a draw from ``popular``,
+    which lists every tweet once per reply it received, so conversations grow
+    around tweets that are already busy.
+    """
+    if popular and rng.random() < 0.5:
+        return rng.choice(popular)
+    return max(1, newest_id - int(rng.expovariate(1 / 50)))
+
+def generate_corpus(tweets_db, prompts_db, tweets, seed=0):
+    """Append ``tweets`` synthetic tweets and matching token usage rows.
+
+    Usernames follow a Zipf-like distribution, so a few accounts post most
+    of the tweets. Rows are inserted in batches through the normal triggers,
+    so the change log, search index and usage rollups are populated as they
+    would be in a live database.
+    """
+    import db
+
+    rng = random.Random(seed)
+    users = [f'user{i}' for i in range(USERNAMES)]
+    weights = [1 / (i + 1) for i in range(USERNAMES)]
+    popular = []
+    start = datetime.datetime(2024, 1, 1)
+
+    with db.connect(tweets_db) as conn:
+        next_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM tweets').fetchone()[0] + 1
+    last_id = next_id + tweets - 1
+    for batch_start in range(next_id, last_id + 1, INSERT_BATCH):
+        rows = []
+        for tweet_id in range(batch_start, min(batch_start + INSERT_BATCH, last_id + 1)):
+            replying_to = quoting = None
+            roll = rng.random()
+            if tweet_id > 1 and roll < REPLY_RATIO:
+                replying_to = _pick_target(rng, popular, tweet_id - 1)
+                popular.append(replying_to)
+            elif tweet_id > 1 and roll < REPLY_RATIO + QUOTE_RATIO:
+                quoting = _pick_target(rng, popular, tweet_id - 1)
+            timestamp = start + datetime.timedelta(seconds=tweet_id * 7)
+            rows.append((
+                tweet_id,
+                rng.choices(users, weights)[0],
+                ' '.join(rng.choices(WORDS, k=rng.randint(4, 30))),
+                timestamp.isoformat() + 'Z',
+                replying_to,
+                quoting,
+                int(rng.paretovariate(1.5)) - 1,
+            ))
+        with db.transaction(tweets_db) as conn:
+            conn.executemany(
+                'INSERT INTO tweets (id, username, text, timestamp, replying_to, quoting_tweet_id, like_count) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    usage = []
+    for i in range(int(tweets * USAGE_PER_TWEET)):
+        prompt_tokens = rng.randint(150, 600)
+        completion_tokens = rng.randint(10, 80)
+        usage.append((
+            (start + datetime.timedelta(seconds=i * 70)).isoformat() + 'Z',
+            prompt_tokens,
+            completion_tokens,
+            prompt_tokens + completion_tokens,
+            rng.choice(('TechOptimist', 'GrumpyCatBot', 'HistoryBuff')),
+        ))
+    with db.transaction(prompts_db) as conn:
+        conn.executemany(
+            'INSERT INTO token_usage (timestamp, prompt_tokens, completion_tokens, total_tokens, persona) '
+            'VALUES (?, ?, ?, ?, ?)',
+            usage,
+        )
+
+
+# --- Stub LLM ---
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Answers chat completion requests with a canned bot decision after
+    ``server.latency`` seconds (plus up to ``server.jitter``)."""
+
+    protocol_version = 'HTTP/1.1'
+    counter = itertools.count(1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = payload['messages'][-1]['content']
+        time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+
+        # Imported here, after main() has pointed llm_bot at this server
+        import simulate
+        content = simulate.stub_decision(prompt, random, next(self.counter))
+        body = json.dumps({
+            'choices': [{'message': {'content': content}}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 12, 'total_tokens': len(prompt) // 4 + 12},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_stub_llm(latency, jitter=0.0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    threading.Thread(target=server.serve_forever, name='stub-llm', daemon=True).start()
+    return server
+
+
+# --- Load generation ---
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def rss_mb():
+    """Current resident set size, falling back to the peak where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+class Client:
+    """One simulated user. Each scenario method makes one request and
+    returns the response so the caller can time it."""
+
+    def __init__(self, base_url, max_id, rng):
+        self.base_url = base_url
+        self.max_id = max_id
+        self.rng = rng
+        self.session = requests.Session()
+        self.cursor = 0
+        self.next_page = None
+        self.job_ids = []
+
+    def poll(self):
+        # What the front end does every second while the stream is down
+        response = self.session.get(f'{self.base_url}/api/tweets', params={'since': self.cursor, 'limit': FEED_PAGE})
+        if response.ok:
+            self.cursor = response.json()['cursor']
+        return response
+
+    def feed(self):
+        # Scroll: first page, then older pages until a random depth
+        params = {'limit': FEED_PAGE}
+        if self.next_page and self.rng.random() < 0.8:
+            params['before'] = self.next_page
+        response = self.session.get(f'{self.base_url}/api/tweets', params=params)
+        if response.ok:
+            self.next_page = response.json()['next']
+        return response
+
+    def tweet(self):
+        return self.session.get(f'{self.base_url}/api/tweets/{self.rng.randint(1, self.max_id)}')
+
+    def like(self):
+        return self.session.post(f'{self.base_url}/api/tweets/{self.rng.randint(1, self.max_id)}/like')
+
+    def run_bot(self):
+        response = self.session.post(f'{self.base_url}/api/run_bot', json={'cycles': 1})
+        if response.status_code == 202:
+            self.job_ids.append(response.json()['job_id'])
+        return response
+
+def run_scenario(name, base_url, max_id, concurrency, duration, seed, trace_memory):
+    """Drive one scenario from ``concurrency`` threads for ``duration`` seconds."""
+    clients = [Client(base_url, max_id, random.Random(seed + i)) for i in range(concurrency)]
+    latencies = [[] for _ in clients]
+    statuses = {}
+    statuses_lock = threading.Lock()
+    response_bytes = [0]
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        client = clients[i]
+        request = getattr(client, name)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = request()
+                status = str(response.status_code)
+                size = len(response.content)
+            except requests.RequestException as e:
+                status, size = type(e).__name__, 0
+            latencies[i].append(time.perf_counter() - started)
+            with statuses_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                response_bytes[0] += size
+
+    rss_before = rss_mb()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = sorted(itertools.chain.from_iterable(latencies))
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    result = {
+        'requests': len(all_latencies),
+        'errors': sum(count for status, count in statuses.items() if not status.startswith('2')),
+        'statuses': statuses,
+        'throughput_rps': round(len(all_latencies) / elapsed, 1),
+        'mean_ms': ms(sum(all_latencies) / len(all_latencies)) if all_latencies else None,
+        'p50_ms': ms(percentile(all_latencies, 50)),
+        'p95_ms': ms(percentile(all_latencies, 95)),
+        'p99_ms': ms(percentile(all_latencies, 99)),
+        'max_ms': ms(all_latencies[-1] if all_latencies else None),
+        'mean_response_bytes': round(response_bytes[0] / len(all_latencies)) if all_latencies else None,
+        'rss_mb': round(rss_mb(), 1),
+        'rss_delta_mb': round(rss_mb() - rss_before, 1),
+    }
+    if trace_memory:
+        result['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    if name == 'run_bot':
+        result['jobs'] = wait_for_jobs(clients, base_url)
+    return result
+
+def wait_for_jobs(clients, base_url, timeout=60):
+    """Wait for the accepted bot jobs and summarise their queue and run times."""
+    session = requests.Session()
+    pending = [job_id for client in clients for job_id in client.job_ids]
+    finished = []
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        still_pending = []
+        for job_id in pending:
+            job = session.get(f'{base_url}/api/bot_jobs/{job_id}').json()
+            if job.get('status') in ('done', 'failed'):
+                finished.append(job)
+            else:
+                still_pending.append(job_id)
+        pending = still_pending
+        if pending:
+            time.sleep(0.1)
+    queue_times = sorted(job['queue_seconds'] for job in finished)
+    run_times = sorted(job['run_seconds'] for job in finished)
+    return {
+        'accepted': len(finished) + len(pending),
+        'done': sum(job['status'] == 'done' for job in finished),
+        'failed': sum(job['status'] == 'failed' for job in finished),
+        'unfinished': len(pending),
+        'queue_p50_ms': round(percentile(queue_times, 50) * 1000, 1) if queue_times else None,
+        'run_p50_ms': round(percentile(run_times, 50) * 1000, 1) if run_times else None,
+        'run_p95_ms': round(percentile(run_times, 95) * 1000, 1) if run_times else None,
+    }
+
+
+# --- Entry point ---
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current):
+    """Print the p50/p95/p99 and throughput change per scenario."""
+    for name, now in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if before.get(key) and now.get(key) is not None:
+                changes.append(f"{key} {before[key]} -> {now[key]} ({(now[key] - before[key]) / before[key]:+.0%})")
+        print(f"{name}: " + ', '.join(changes), file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tweets', type=int, default=10000, help='corpus size (default 10000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='directory for tweets.db/prompts.db; an existing corpus there is reused')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=8, help='simulated clients per scenario')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='stub LLM response time in seconds')
+    parser.add_argument('--llm-jitter', type=float, default=0.1, help='extra random stub LLM latency in seconds')
+    parser.add_argument('--trace-memory', action='store_true', help='also report tracemalloc peaks (slows the server)')
+    parser.add_argument('--verbose', action='store_true', help="show the app's and bots' own output")
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='previous JSON report to compare against')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # The app and bot read their configuration at import time and use
+    # database paths relative to the working directory.
+    output = os.path.abspath(args.output) if args.output else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='lan-twitter-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(data_dir)
+    stub = start_stub_llm(args.llm_latency, args.llm_jitter)
+    os.environ['OPENROUTER_API_URL'] = f'http://127.0.0.1:{stub.server_port}/v1/chat/completions'
+    os.environ.setdefault('OPENROUTER_API_KEY', 'benchmark')
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        import app
+        import db
+        from werkzeug.serving import make_server
+
+        # No archival passes in the middle of a measurement
+        app.init_schema()
+        app.init_process(archiver=False)
+        with db.connect(app.DB_FILE) as conn:
+            existing = conn.execute('SELECT COUNT(*) FROM tweets').fetchone()[0]
+        if existing < args.tweets:
+            started = time.perf_counter()
+            generate_corpus(app.DB_FILE, app.PROMPT_DB_FILE, args.tweets - existing, args.seed)
+            print(f"Generated {args.tweets - existing} tweets in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        with db.connect(app.DB_FILE) as conn:
+            max_id = conn.execute('SELECT COALESCE(MAX(id), 1) FROM tweets').fetchone()[0]
+            app._published_cursor = app.current_change_cursor(conn.cursor())
+
+        if not args.verbose:
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        if args.trace_memory:
+            tracemalloc.start()
+        results = {}
+        for i, name in enumerate(scenarios):
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = run_scenario(
+                name, base_url, max_id, args.concurrency, args.duration, args.seed + i * 1000, args.trace_memory,
+            )
+        app.writer.flush()
+        server.shutdown()
+        stub.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': sys.version.split()[0],
+        'config': {
+            'tweets': args.tweets,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'llm_latency_seconds': args.llm_latency,
+            'llm_jitter_seconds': args.llm_jitter,
+        },
+        'data_dir': data_dir,
+        'endpoints': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if previous:
+        with open(previous) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# bot_jobs.py
+"""Fixed-size worker pool that runs queued bot cycles."""
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+BOT_WORKERS = 4
+BOT_QUEUE_SIZE = 32
+MAX_CYCLES_PER_JOB = 50
+# Finished jobs kept around for status lookups
+JOB_HISTORY = 500
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BotJob:
+    def __init__(self, job_id, mode, cycles):
+        self.id = job_id
+        self.mode = mode
+        self.cycles = cycles
+        self.completed_cycles = 0
+        self.status = 'queued'
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        now = time.time()
+        started = self.started_at or now
+        return {
+            'id': self.id,
+            'status': self.status,
+            'mode': self.mode,
+            'cycles': self.cycles,
+            'completed_cycles': self.completed_cycles,
+            'error': self.error,
+            'queue_seconds': round(started - self.submitted_at, 3),
+            'run_seconds': round((self.finished_at or now) - started, 3) if self.started_at else None,
+        }
+
+
+class BotScheduler:
+    """Run bot cycles on a bounded pool of worker threads.
+
+    ``modes`` maps a mode name to the function that runs one cycle of it.
+    Jobs wait in a bounded queue; ``submit`` raises QueueFull instead of
+    spawning more threads when it is full.
+    """
+
+    def __init__(self, modes, workers=BOT_WORKERS, max_queue=BOT_QUEUE_SIZE):
+        self.modes = modes
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._threads = []
+        self.running = 0
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f'bot-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, mode, cycles=1):
+        self._ensure_workers()
+        with self._lock:
+            job = BotJob(next(self._ids), mode, cycles)
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY:
+                self._jobs.popitem(last=False)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFull()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self.running += 1
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                run_cycle = self.modes[job.mode]
+                for _ in range(job.cycles):
+                    run_cycle()
+                    job.completed_cycles += 1
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self.running -= 1
+                self._queue.task_done()
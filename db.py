@@ -0,0 +1,167 @@
+# db.py
+"""Shared SQLite connection layer for tweets.db and prompts.db.
+
+Connections are pooled per database file instead of opened per call. Each
+one runs in WAL mode so bot writes don't block feed reads, and keeps
+sqlite3's per-connection statement cache warm so hot queries are prepared
+once rather than on every request.
+"""
+import functools
+import math
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT_MS = 5000
+BUSY_RETRIES = 5
+BUSY_BACKOFF_SECONDS = 0.01
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    # NORMAL is durable across application crashes in WAL mode and skips the
+    # fsync on every commit
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16384',  # 16 MiB
+    'PRAGMA mmap_size=268435456',  # 256 MiB
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+)
+
+
+class ConnectionPool:
+    """A LIFO pool of connections to one database file.
+
+    Connections are handed to one thread at a time, so they are opened with
+    ``check_same_thread=False`` and can be reused by the short-lived request
+    threads of the Flask server.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.hooks = []
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        ensure_math_functions(conn)
+        for hook in self.hooks:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def ensure_math_functions(conn):
+    """Register ln() and exp() when SQLite was built without its math
+    functions, which the trending-score triggers rely on."""
+    try:
+        conn.execute('SELECT ln(1), exp(0)')
+    except sqlite3.OperationalError:
+        conn.create_function('ln', 1, math.log, deterministic=True)
+        conn.create_function('exp', 1, math.exp, deterministic=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def close_all():
+    """Close every idle pooled connection, e.g. before forking worker
+    processes, which must not inherit open SQLite connections."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def add_connect_hook(path, hook):
+    """Run ``hook(conn)`` on every new connection to ``path``, e.g. to
+    ATTACH another database. Idle connections opened before it was added
+    are closed, so the pool reopens them with the hook."""
+    pool = get_pool(path)
+    pool.hooks.append(hook)
+    pool.close_all()
+
+
+@contextmanager
+def connect(path):
+    """Borrow a pooled connection. Any open transaction is rolled back when
+    the connection is returned, so read-only callers never need to commit."""
+    pool = get_pool(path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(path):
+    """Borrow a pooled connection and commit on success, roll back on error."""
+    with connect(path) as conn:
+        with conn:
+            yield conn
+
+
+def is_busy_error(exc):
+    return isinstance(exc, sqlite3.OperationalError) and (
+        'locked' in str(exc) or 'busy' in str(exc)
+    )
+
+
+def retry_on_busy(func):
+    """Re-run ``func`` with backoff when SQLite reports the database is busy.
+
+    ``busy_timeout`` already waits for most lock conflicts; this covers the
+    cases where SQLite gives up immediately, such as a deferred transaction
+    that cannot upgrade to a write lock.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == BUSY_RETRIES - 1:
+                    raise
+                time.sleep(BUSY_BACKOFF_SECONDS * (2 ** attempt))
+    return wrapper
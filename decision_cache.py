@@ -0,0 +1,124 @@
+# decision_cache.py
+"""Two-tier cache of LLM decisions keyed by model and prompt."""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import db
+import metrics
+
+MEMORY_ENTRIES = 256
+MAX_ROWS = 10000
+TTL_SECONDS = 3600
+# Size eviction runs on every Nth put rather than on each one
+EVICT_EVERY = 100
+
+cache_lookups = metrics.counter(
+    'lan_twitter_llm_cache_lookups_total', 'LLM decision cache lookups by tier that answered.', ('result',))
+
+
+def cache_key(model, persona_prompt, prompt):
+    """Hash of everything that determines the LLM's answer. ``prompt`` is the
+    full rendered prompt, so it covers the system prompt and the context."""
+    digest = hashlib.sha256()
+    for part in (model, persona_prompt, prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DecisionCache:
+    """An in-memory LRU in front of a ``decision_cache`` table.
+
+    Entries older than ``ttl`` are ignored by ``get`` but kept on disk, so
+    ``get(..., replay=True)`` can still serve every recorded response. The
+    table is trimmed to the ``max_rows`` most recently used entries.
+    """
+
+    def __init__(self, path, memory_entries=MEMORY_ENTRIES, max_rows=MAX_ROWS, ttl=TTL_SECONDS):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._puts = 0
+        with db.transaction(path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS decision_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    persona TEXT NOT NULL,
+                    decision TEXT NOT NULL,
+                    usage TEXT,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_decision_cache_last_used ON decision_cache(last_used)')
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key, replay=False):
+        """Return (decision, usage) or None. ``replay`` ignores the TTL."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None and (replay or now - entry[2] < self.ttl):
+            cache_lookups.inc(result='memory')
+            return entry[0], entry[1]
+
+        with db.connect(self.path) as conn:
+            row = conn.execute(
+                'SELECT decision, usage, created_at FROM decision_cache WHERE key=?', (key,)
+            ).fetchone()
+        if row is None or not (replay or now - row['created_at'] < self.ttl):
+            cache_lookups.inc(result='miss')
+            return None
+        entry = (row['decision'], json.loads(row['usage']) if row['usage'] else None, row['created_at'])
+        self._remember(key, entry)
+        self._touch(key, now)
+        cache_lookups.inc(result='sqlite')
+        return entry[0], entry[1]
+
+    @db.retry_on_busy
+    def _touch(self, key, now):
+        with db.transaction(self.path) as conn:
+            conn.execute('UPDATE decision_cache SET last_used=? WHERE key=?', (now, key))
+
+    @db.retry_on_busy
+    def put(self, key, model, persona, decision, usage=None):
+        now = time.time()
+        self._remember(key, (decision, usage, now))
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % EVICT_EVERY == 0
+        with db.transaction(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO decision_cache (key, model, persona, decision, usage, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, model, persona, decision, json.dumps(usage) if usage else None, now, now),
+            )
+            if evict:
+                conn.execute(
+                    'DELETE FROM decision_cache WHERE key IN '
+                    '(SELECT key FROM decision_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_rows,),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        with db.transaction(self.path) as conn:
+            conn.execute('DELETE FROM decision_cache')
@@ -0,0 +1,71 @@
+# events.py
+import threading
+from collections import deque
+
+SUBSCRIBER_BUFFER_SIZE = 100
+
+
+class Subscription:
+    """A single stream client's bounded event buffer."""
+
+    def __init__(self, buffer_size):
+        self.events = deque(maxlen=buffer_size)
+        self.overflowed = False
+        self.cond = threading.Condition()
+
+    def push(self, event):
+        with self.cond:
+            if len(self.events) == self.events.maxlen:
+                # The client fell behind; drop what it has and make it resync
+                self.events.clear()
+                self.overflowed = True
+            else:
+                self.events.append(event)
+            self.cond.notify()
+
+    def get(self, timeout):
+        """Wait for the next event. Returns None on timeout and the string
+        'overflow' if events were dropped since the last call."""
+        with self.cond:
+            if not self.events and not self.overflowed:
+                self.cond.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                return 'overflow'
+            if self.events:
+                return self.events.popleft()
+            return None
+
+
+class EventBroker:
+    """Fan out (event_id, data) pairs to every subscribed stream."""
+
+    def __init__(self, buffer_size=SUBSCRIBER_BUFFER_SIZE, max_subscribers=None):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        """Return a new Subscription, or None when ``max_subscribers`` are
+        already subscribed."""
+        sub = Subscription(self.buffer_size)
+        with self._lock:
+            if self.max_subscribers is not None and len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, event_id, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.push((event_id, data))
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
@@ -0,0 +1,71 @@
+# gunicorn.conf.py
+"""Production server settings, picked up by running ``gunicorn app:app``
+from this directory. Flags such as ``--workers 4`` or ``--bind`` override
+them.
+
+The master creates or migrates the schemas once before forking. Each
+worker serves requests on a pool of threads, is restarted by gunicorn if it
+dies or stops answering, and flushes queued likes and token usage when it
+exits.
+
+Workers share nothing but the databases. Persona and system prompt edits
+reach every worker through prompts.db's config_version counter, and each
+worker polls the change log to feed its own /api/stream subscribers. One
+worker at a time runs the archiver. Metrics, the profiler and bot job
+status are per worker.
+"""
+import fcntl
+import os
+
+bind = '0.0.0.0:5001'
+workers = os.cpu_count() or 1
+worker_class = 'gthread'
+# Each /api/stream client holds a thread for as long as it stays connected.
+# At most STREAM_MAX_SUBSCRIBERS (default 16) of them are streams; beyond
+# that /api/stream answers 503 and browsers poll, so the rest of the
+# threads always serve ordinary requests.
+threads = 32
+# Workers that stop heartbeating for this long are killed and replaced
+timeout = 30
+# Requests still running this long after SIGTERM are cut off. Streams never
+# finish on their own; their clients reconnect with Last-Event-ID.
+graceful_timeout = 10
+accesslog = None
+
+ARCHIVER_LOCK_FILE = 'tweets_archive.db.lock'
+_archiver_lock = None
+
+
+def hold_archiver_lock():
+    """True in the one worker holding the archiver lock. The lock goes with
+    its process, so the worker that replaces it takes the archiver over."""
+    global _archiver_lock
+    lock_file = open(ARCHIVER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _archiver_lock = lock_file
+    return True
+
+
+def on_starting(server):
+    import app
+    import db
+
+    app.init_schema()
+    # Workers open their own connections after the fork
+    db.close_all()
+
+
+def post_fork(server, worker):
+    import app
+
+    app.init_process(archiver=app.ARCHIVE_INTERVAL_SECONDS > 0 and hold_archiver_lock())
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.writer.close()
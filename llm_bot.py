@@ -2,13 +2,46 @@ import os
 import requests
 import random
 import json
-import sqlite3
 import datetime
+import string
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import db
+import metrics
+from decision_cache import DecisionCache, cache_key
+from llm_client import LLMClient
+from write_behind import WriteBehind
 
 # --- CONFIGURATION ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Overridable so the bot can be pointed at a local stub server
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_MODEL = "openai/gpt-4o-mini"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 60
+LLM_MAX_RETRIES = 3
+# Decision cache: "off", "on" (reuse answers younger than LLM_CACHE_TTL
+# seconds) or "replay" (serve recorded answers only, never call the API)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE", "off")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
 LAN_TWTTR_API_URL = "http://localhost:5001/api/tweets"
+LAN_TWTTR_TRENDING_URL = "http://localhost:5001/api/trending"
+
+# Tweets shown to the LLM as context
+CONTEXT_TWEET_COUNT = 5
+# The fields format_context_for_llm reads. Bots fetch only these, which
+# spares the server the reply and quote counts.
+CONTEXT_FIELDS = ('id', 'username', 'text')
+
+llm_request_seconds = metrics.histogram(
+    'lan_twitter_llm_request_seconds', 'LLM decision latency, including retries.', ('persona', 'outcome'))
+llm_tokens = metrics.counter('lan_twitter_llm_tokens_total', 'Tokens used by LLM calls.', ('persona', 'kind'))
+llm_call_tokens = metrics.histogram(
+    'lan_twitter_llm_call_tokens', 'Total tokens per LLM call.', ('persona',), metrics.TOKEN_BUCKETS)
 
 PROMPT_DB_FILE = "prompts.db"
 
@@ -30,142 +63,270 @@ DEFAULT_PERSONAS = [
 ]
 
 def init_prompt_db():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS personas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            prompt TEXT NOT NULL
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS system_prompt (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            instructions TEXT NOT NULL
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS token_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            prompt_tokens INTEGER,
-            completion_tokens INTEGER,
-            total_tokens INTEGER,
-            persona TEXT
+    with db.transaction(PROMPT_DB_FILE) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS personas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                prompt TEXT NOT NULL
+            )
+            """
         )
-        """
-    )
-    conn.commit()
-    cur.execute("SELECT COUNT(*) FROM personas")
-    if cur.fetchone()[0] == 0:
-        cur.executemany(
-            "INSERT INTO personas (name, prompt) VALUES (?, ?)", DEFAULT_PERSONAS
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS system_prompt (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                instructions TEXT NOT NULL
+            )
+            """
         )
-        conn.commit()
-    cur.execute("SELECT COUNT(*) FROM system_prompt")
-    if cur.fetchone()[0] == 0:
         cur.execute(
-            "INSERT INTO system_prompt (id, instructions) VALUES (1, ?)",
-            (DEFAULT_SYSTEM_PROMPT,),
+            """
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER,
+                persona TEXT
+            )
+            """
         )
-        conn.commit()
-    conn.close()
+        cur.execute("SELECT COUNT(*) FROM personas")
+        if cur.fetchone()[0] == 0:
+            cur.executemany(
+                "INSERT INTO personas (name, prompt) VALUES (?, ?)", DEFAULT_PERSONAS
+            )
+        cur.execute("SELECT COUNT(*) FROM system_prompt")
+        if cur.fetchone()[0] == 0:
+            cur.execute(
+                "INSERT INTO system_prompt (id, instructions) VALUES (1, ?)",
+                (DEFAULT_SYSTEM_PROMPT,),
+            )
+        create_config_version(cur)
 
 
-def load_system_prompt():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT instructions FROM system_prompt WHERE id=1")
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else DEFAULT_SYSTEM_PROMPT
+def create_config_version(cur):
+    """A counter that triggers bump on every write to personas or
+    system_prompt, whichever process makes it. Each process compares it
+    with the version of its cached PromptConfig."""
+    cur.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS config_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO config_version (id, version) VALUES (1, 0);
+        CREATE TRIGGER IF NOT EXISTS personas_config_insert AFTER INSERT ON personas BEGIN
+            UPDATE config_version SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS personas_config_update AFTER UPDATE ON personas BEGIN
+            UPDATE config_version SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS personas_config_delete AFTER DELETE ON personas BEGIN
+            UPDATE config_version SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS system_prompt_config_update AFTER UPDATE ON system_prompt BEGIN
+            UPDATE config_version SET version = version + 1;
+        END;
+        """
+    )
 
 
-def load_personas():
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT name, prompt FROM personas")
-    personas = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    return personas
+# Token usage of the standalone bot is batched and flushed at exit. Bots run
+# by the app log through the app's writer instead, via its timeline.
+usage_writer = WriteBehind(prompts_db=PROMPT_DB_FILE)
 
 def log_token_usage(prompt_tokens, completion_tokens, total_tokens, persona):
-    conn = sqlite3.connect(PROMPT_DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO token_usage (timestamp, prompt_tokens, completion_tokens, total_tokens, persona) VALUES (?, ?, ?, ?, ?)",
+    usage_writer.add_token_usage(
         (
             datetime.datetime.utcnow().isoformat() + 'Z',
             prompt_tokens,
             completion_tokens,
             total_tokens,
             persona,
-        ),
+        )
     )
-    conn.commit()
-    conn.close()
 
-def get_latest_tweets():
+class PromptTemplate:
+    """System prompt parsed once into literal text and ``{field}`` slots.
+
+    ``render(context=...)`` produces the same result as ``str.format`` on the
+    raw text, without re-parsing the template on every call.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._parts = [
+            (literal, field, spec)
+            for literal, field, spec, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **values):
+        chunks = []
+        for literal, field, spec in self._parts:
+            chunks.append(literal)
+            if field is not None:
+                chunks.append(format(values[field], spec or ''))
+        return ''.join(chunks)
+
+
+PromptConfig = namedtuple('PromptConfig', 'version personas template')
+
+_config_lock = threading.Lock()
+_config = None
+_prompt_db_ready = False
+
+def get_prompt_config():
+    """Return the cached PromptConfig, reloading it when config_version has
+    moved on, e.g. after any process edited a persona. The check is a
+    single primary-key read."""
+    global _config, _prompt_db_ready
+    if not _prompt_db_ready:
+        init_prompt_db()
+        _prompt_db_ready = True
+    with db.connect(PROMPT_DB_FILE) as conn:
+        # One read transaction, so the version matches what is loaded
+        conn.execute('BEGIN')
+        version = conn.execute("SELECT version FROM config_version WHERE id=1").fetchone()[0]
+        with _config_lock:
+            if _config is not None and _config.version == version:
+                return _config
+        personas = [dict(row) for row in conn.execute("SELECT name, prompt FROM personas")]
+        row = conn.execute("SELECT instructions FROM system_prompt WHERE id=1").fetchone()
+    config = PromptConfig(version, personas, PromptTemplate(row[0] if row else DEFAULT_SYSTEM_PROMPT))
+    with _config_lock:
+        _config = config
+    return config
+
+def get_latest_tweets(limit=CONTEXT_TWEET_COUNT):
     """Fetches the latest tweets from the LAN Twitter API."""
     try:
         # The main feed only returns top-level tweets. This is perfect for context.
-        response = requests.get(LAN_TWTTR_API_URL)
+        response = requests.get(LAN_TWTTR_API_URL, params={'limit': limit, 'fields': ','.join(CONTEXT_FIELDS)})
         response.raise_for_status()
-        return response.json()
+        return response.json()['tweets']
     except requests.exceptions.RequestException as e:
         print(f"ERROR: Could not fetch latest tweets. {e}")
         return []
 
+def get_trending_tweets(limit=CONTEXT_TWEET_COUNT):
+    """Fetches the tweets with the most recent engagement."""
+    try:
+        response = requests.get(LAN_TWTTR_TRENDING_URL, params={'limit': limit, 'fields': ','.join(CONTEXT_FIELDS)})
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"ERROR: Could not fetch trending tweets. {e}")
+        return []
+
 def format_context_for_llm(tweets):
     """Formats a list of tweets into a simple string for the LLM prompt."""
     if not tweets:
         return "The timeline is empty."
     
     formatted_tweets = []
-    for tweet in tweets[:5]: # Only use the last 5 tweets for context
+    for tweet in tweets[:CONTEXT_TWEET_COUNT]: # Only use the latest tweets for context
         text = tweet['text'].replace('\n', ' ') # Flatten newlines
         formatted_tweets.append(f"Tweet (ID {tweet['id']}) by @{tweet['username']}: \"{text}\"")
     return "\n".join(formatted_tweets)
 
-def get_llm_decision(persona, context):
-    """Gets a decision (tweet, reply, quote) from the OpenRouter API."""
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Return the process-wide LLM client, creating it on first use."""
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            _llm_client = LLMClient(
+                OPENROUTER_API_URL,
+                OPENROUTER_API_KEY,
+                max_concurrency=LLM_MAX_CONCURRENCY,
+                connect_timeout=LLM_CONNECT_TIMEOUT,
+                read_timeout=LLM_READ_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+            )
+        return _llm_client
+
+_decision_cache = None
+
+def get_decision_cache():
+    """Return the process-wide decision cache, or None when it is off."""
+    global _decision_cache
+    if LLM_CACHE_MODE not in ('on', 'replay'):
+        return None
+    with _llm_client_lock:
+        if _decision_cache is None:
+            _decision_cache = DecisionCache(PROMPT_DB_FILE, ttl=LLM_CACHE_TTL)
+        return _decision_cache
+
+def record_usage(persona, usage, timeline):
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        llm_tokens.inc(usage.get(kind) or 0, persona=persona['name'], kind=kind.split('_')[0])
+    llm_call_tokens.observe(usage.get('total_tokens') or 0, persona=persona['name'])
+    timeline.log_token_usage(
+        usage.get('prompt_tokens'),
+        usage.get('completion_tokens'),
+        usage.get('total_tokens'),
+        persona['name'],
+    )
+
+def build_prompt(persona, context, config):
+    """The full prompt sent to the LLM for ``persona`` given ``context``,
+    using the system prompt of ``config``."""
+    instructions = config.template.render(context=context)
+    return f"{persona['prompt']}\n\n{instructions}"
+
+def get_llm_decision(persona, context, config, timeline):
+    """Gets a decision (tweet, reply, quote) from the OpenRouter API.
+
+    Token usage is logged through ``timeline``.
+
+    With the decision cache on, an identical model, persona and prompt
+    reuses the earlier answer. In replay mode only recorded answers are
+    served, and their recorded usage is logged as if the call was made.
+    """
+    system_prompt = build_prompt(persona, context, config)
+    cache = get_decision_cache()
+    key = cache_key(LLM_MODEL, persona['prompt'], system_prompt) if cache else None
+    if cache:
+        cached = cache.get(key, replay=LLM_CACHE_MODE == 'replay')
+        if cached:
+            decision_text, usage = cached
+            if LLM_CACHE_MODE == 'replay' and usage:
+                record_usage(persona, usage, timeline)
+            print(f"-> Cached LLM Decision:\n{decision_text}")
+            return decision_text
+        if LLM_CACHE_MODE == 'replay':
+            print(f"ERROR: No recorded decision for '{persona['name']}' with this context.")
+            return None
+
     if not OPENROUTER_API_KEY:
         print("ERROR: OPENROUTER_API_KEY environment variable not set.")
         return None
 
-    instructions = load_system_prompt().format(context=context)
-    system_prompt = f"{persona['prompt']}\n\n{instructions}"
-    
     print(f"Bot '{persona['name']}' is thinking...")
     try:
         payload = {
-            "model": "openai/gpt-4o-mini",
+            "model": LLM_MODEL,
             "messages": [{"role": "user", "content": system_prompt}]
         }
         print(f"-> LLM Request:\n{json.dumps(payload, indent=2)}")
-        response = requests.post(
-            url=OPENROUTER_API_URL,
-            headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
-            json=payload
-        )
-        response.raise_for_status()
-        data = response.json()
+        started = time.perf_counter()
+        try:
+            data = get_llm_client().chat(payload)
+        except Exception:
+            llm_request_seconds.observe(time.perf_counter() - started, persona=persona['name'], outcome='error')
+            raise
+        llm_request_seconds.observe(time.perf_counter() - started, persona=persona['name'], outcome='ok')
         decision_text = data['choices'][0]['message']['content'].strip()
         if 'usage' in data:
-            usage = data['usage']
-            log_token_usage(
-                usage.get('prompt_tokens'),
-                usage.get('completion_tokens'),
-                usage.get('total_tokens'),
-                persona['name'],
-            )
+            record_usage(persona, data['usage'], timeline)
+        if cache:
+            cache.put(key, LLM_MODEL, persona['name'], decision_text, data.get('usage'))
         print(f"-> LLM Decision:\n{decision_text}")
         return decision_text
     except Exception as e:
@@ -205,25 +366,43 @@ def post_to_lan_twitter(username, payload):
         print(f"ERROR: Could not post to LAN Twitter API. {e}")
 
 
-def run_bot():
-    """Run a single LLM bot cycle."""
-    init_prompt_db()
-    personas = load_personas()
-    if not personas:
-        print("ERROR: No personas available.")
-        return
+def post_batch_to_lan_twitter(posts):
+    """Posts several tweets in one request to the batch endpoint."""
+    print(f"Posting {len(posts)} tweets to LAN Twitter")
+    try:
+        response = requests.post(f"{LAN_TWTTR_API_URL}/batch", json=posts)
+        response.raise_for_status()
+        print("-> Successfully posted!")
+    except requests.exceptions.RequestException as e:
+        print(f"ERROR: Could not post to LAN Twitter API. {e}")
 
-    # 1. Choose a bot persona
-    chosen_persona = random.choice(personas)
 
-    # 2. Perceive: Get the latest tweets
-    latest_tweets = get_latest_tweets()
-    context_str = format_context_for_llm(latest_tweets)
+class HttpTimeline:
+    """Timeline backend that talks to a running LAN Twitter server.
 
-    # 3. Decide: Get a decision from the LLM
-    llm_response = get_llm_decision(chosen_persona, context_str)
+    Used when the bot runs standalone (``python llm_bot.py``). Inside the
+    Flask process the app passes an in-process backend with the same
+    methods instead.
+    """
 
-    # 4. Act: Parse the decision and post accordingly
+    def latest_tweets(self, limit):
+        return get_latest_tweets(limit)
+
+    def trending_tweets(self, limit):
+        return get_trending_tweets(limit)
+
+    def post(self, username, payload):
+        post_to_lan_twitter(username, payload)
+
+    def post_batch(self, posts):
+        post_batch_to_lan_twitter(posts)
+
+    def log_token_usage(self, prompt_tokens, completion_tokens, total_tokens, persona):
+        log_token_usage(prompt_tokens, completion_tokens, total_tokens, persona)
+
+
+def decision_to_payload(llm_response):
+    """Parse an LLM response into a tweet, reply or quote payload, or None."""
     decision = parse_llm_decision(llm_response)
 
     if decision and 'ACTION' in decision and 'CONTENT' in decision:
@@ -248,9 +427,72 @@ def run_bot():
                     f"WARNING: Invalid ID '{decision['ID']}'. Posting as a new tweet instead."
                 )
 
-        post_to_lan_twitter(chosen_persona['name'], post_payload)
-    else:
-        print("Could not execute a valid action based on LLM response.")
+        return post_payload
+    print("Could not execute a valid action based on LLM response.")
+    return None
+
+
+def act_on_decision(persona, llm_response, timeline):
+    """Parse an LLM response and post the resulting tweet, reply or quote."""
+    post_payload = decision_to_payload(llm_response)
+    if post_payload:
+        timeline.post(persona['name'], post_payload)
+
+
+def run_bot(timeline=None):
+    """Run a single LLM bot cycle against ``timeline`` (HTTP by default)."""
+    timeline = timeline or HttpTimeline()
+    # One config for the whole cycle, even if a persona is edited meanwhile
+    config = get_prompt_config()
+    personas = config.personas
+    if not personas:
+        print("ERROR: No personas available.")
+        return
+
+    # 1. Choose a bot persona
+    chosen_persona = random.choice(personas)
+
+    # 2. Perceive: Get the trending tweets. Fresh tweets rank high too, as
+    # scores decay with age, so bots see both new and busy conversations.
+    trending_tweets = timeline.trending_tweets(CONTEXT_TWEET_COUNT)
+    context_str = format_context_for_llm(trending_tweets)
+
+    # 3. Decide: Get a decision from the LLM
+    llm_response = get_llm_decision(chosen_persona, context_str, config, timeline)
+
+    # 4. Act: Parse the decision and post accordingly
+    act_on_decision(chosen_persona, llm_response, timeline)
+
+
+def run_round(timeline=None):
+    """Let every persona decide concurrently against one timeline snapshot.
+
+    All LLM calls are in flight at once (up to LLM_MAX_CONCURRENCY), so a
+    round costs about one LLM round-trip rather than one per persona.
+    """
+    timeline = timeline or HttpTimeline()
+    config = get_prompt_config()
+    personas = config.personas
+    if not personas:
+        print("ERROR: No personas available.")
+        return
+
+    context_str = format_context_for_llm(timeline.trending_tweets(CONTEXT_TWEET_COUNT))
+    workers = min(len(personas), LLM_MAX_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        responses = list(pool.map(lambda p: get_llm_decision(p, context_str, config, timeline), personas))
+
+    # Post the whole round in one batch: one request and one transaction
+    posts = []
+    for persona, llm_response in zip(personas, responses):
+        post_payload = decision_to_payload(llm_response)
+        if post_payload:
+            posts.append({'username': persona['name'], **post_payload})
+    if posts:
+        timeline.post_batch(posts)
 
 if __name__ == "__main__":
-    run_bot()
+    if "--round" in sys.argv[1:]:
+        run_round()
+    else:
+        run_bot()
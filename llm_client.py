@@ -0,0 +1,88 @@
+# llm_client.py
+"""Thread-safe HTTP client for the chat completions API."""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest a retry waits, whatever Retry-After asks for, so one rate-limited
+# response can't tie up a bot worker thread for long
+MAX_RETRY_DELAY_SECONDS = 30
+
+llm_retries = metrics.counter('lan_twitter_llm_retries_total', 'LLM requests retried, by cause.', ('reason',))
+llm_in_flight = metrics.gauge('lan_twitter_llm_requests_in_flight', 'LLM requests currently in flight.')
+
+
+class LLMClient:
+    """Keep-alive session with timeouts, jittered retries and a cap on
+    in-flight requests.
+
+    One instance is shared by every bot thread. ``max_concurrency`` bounds
+    both the number of simultaneous requests and the connection pool size,
+    so concurrent callers reuse warm connections instead of opening new ones.
+    """
+
+    def __init__(self, api_url, api_key=None, max_concurrency=8, connect_timeout=5,
+                 read_timeout=60, max_retries=3, backoff=0.5, max_retry_delay=MAX_RETRY_DELAY_SECONDS):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_delay = max_retry_delay
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_retry_delay)
+        # Full jitter so concurrent bots that failed together don't retry together
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def chat(self, payload):
+        """POST ``payload`` and return the decoded JSON response.
+
+        Connection errors, timeouts and 429/5xx responses are retried up to
+        ``max_retries`` times; anything else raises immediately.
+        """
+        for attempt in range(self.max_retries + 1):
+            response = None
+            with self._slots:
+                self._track_in_flight(1)
+                try:
+                    response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    llm_retries.inc(reason=type(e).__name__)
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                        response.raise_for_status()
+                        return response.json()
+                    llm_retries.inc(reason=response.status_code)
+                finally:
+                    self._track_in_flight(-1)
+            time.sleep(self._retry_delay(attempt, response))
+
+    def _track_in_flight(self, delta):
+        with self._in_flight_lock:
+            self._in_flight += delta
+            llm_in_flight.set(self._in_flight)
+
+    def close(self):
+        self.session.close()
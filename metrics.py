@@ -0,0 +1,297 @@
+# metrics.py
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in a module-level registry that
+``render()`` serialises for the ``/metrics`` endpoint. There are no external
+dependencies; a metric is a dict of label values -> numbers behind a lock.
+"""
+import collections
+import functools
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# Seconds; covers a cached SQLite read up to a slow LLM call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+PROFILER_INTERVAL_SECONDS = 0.005
+# Distinct stacks kept by the profiler; rarer ones are dropped once it is full
+PROFILER_MAX_STACKS = 5000
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(v)}' for key, v in items]
+
+
+class Gauge(Metric):
+    """A gauge set explicitly, or read from ``callback()`` at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+            return [f'{self.name} {_format_value(value)}']
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(v)}' for key, v in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then the running sum and total count
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            le = _format_labels(self.labels, key, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{le} {counts[-1]}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-2])}')
+            lines.append(f'{self.name}_count{labels} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering returns the existing metric, so modules that are
+            # imported by both the app and the bot share one series
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+def gauge(name, help, labels=(), callback=None):
+    return REGISTRY.register(Gauge(name, help, labels, callback))
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+def render():
+    return REGISTRY.render()
+
+
+# --- Shared instruments ---
+
+db_query_seconds = histogram('lan_twitter_db_query_seconds', 'Time spent in SQLite data functions.', ('function',))
+db_query_rows = histogram('lan_twitter_db_query_rows', 'Rows returned by SQLite data functions.', ('function',), ROW_BUCKETS)
+db_query_errors = counter('lan_twitter_db_query_errors_total', 'SQLite data function calls that raised.', ('function',))
+
+def _count_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+def timed_query(func=None, rows=_count_rows):
+    """Record the duration and row count of a data function.
+
+    ``rows(result)`` gives the row count; by default a list counts its
+    length, None counts zero and anything else counts one.
+    """
+    if func is None:
+        return functools.partial(timed_query, rows=rows)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            db_query_errors.inc(function=func.__name__)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, function=func.__name__)
+        db_query_rows.observe(rows(result), function=func.__name__)
+        return result
+    return wrapper
+
+
+# --- Sampling profiler ---
+
+class SamplingProfiler:
+    """Periodically sample every thread's stack and count identical stacks.
+
+    Off by default; ``start()``/``stop()`` can be called at runtime. Results
+    are in the collapsed "frame;frame;frame count" format that flame graph
+    tools read.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL_SECONDS, max_stacks=PROFILER_MAX_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        with self._lock:
+            if interval:
+                self.interval = interval
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            sampled = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = [f'{f.name} ({f.filename.rsplit("/", 1)[-1]}:{f.lineno})'
+                         for f in traceback.extract_stack(frame)]
+                sampled.append(';'.join([names.get(thread_id, str(thread_id))] + stack))
+            with self._lock:
+                self._samples += 1
+                for stack in sampled:
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] += 1
+
+    def snapshot(self, top=None):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'samples': self._samples,
+                'stacks': [{'stack': s, 'count': c} for s, c in self._stacks.most_common(top)],
+            }
+
+    def collapsed(self):
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+
+profiler = SamplingProfiler()
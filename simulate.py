@@ -0,0 +1,296 @@
+# simulate.py
+"""Run thousands of bot cycles offline, as fast as possible.
+
+Decisions come from a pluggable provider instead of the LLM API: a seeded
+stub, or a replay file of recorded decisions. Posts are buffered and written
+to tweets.db in batches through ``app.create_tweets``:
+
+    python simulate.py --cycles 5000 --seed 42 --schedule round-robin
+    python simulate.py --provider llm --cycles 20 --record decisions.jsonl
+    python simulate.py --provider replay --replay decisions.jsonl --cycles 5000
+
+Prints a JSON summary including cycles/sec.
+"""
+import argparse
+import collections
+import contextlib
+import io
+import itertools
+import json
+import random
+import re
+import sys
+import time
+
+import llm_bot
+
+BATCH_SIZE = 100
+STUB_WORDS = (
+    'rome', 'viking', 'sunstone', 'nap', 'sunbeam', 'robots', 'future', 'coffee',
+    'monday', 'empire', 'optimism', 'history', 'fact', 'network', 'packet', 'hello',
+)
+# Relative odds of each stub action when there are tweets to reply to or quote
+STUB_ACTIONS = (('TWEET', 4), ('REPLY', 4), ('QUOTE', 2))
+CONTEXT_ID = re.compile(r'Tweet \(ID (\d+)\)')
+DECISION_ID = re.compile(r'^(ID:\s*)(\d+)', re.MULTILINE)
+
+
+def stub_decision(prompt, rng, serial=0):
+    """A well-formed decision in the format the system prompt asks for,
+    replying to or quoting one of the tweet ids shown in ``prompt``."""
+    ids = CONTEXT_ID.findall(prompt)
+    actions, weights = zip(*STUB_ACTIONS)
+    action = rng.choices(actions, weights)[0] if ids else 'TWEET'
+    target = rng.choice(ids) if action != 'TWEET' else 0
+    words = ' '.join(rng.choices(STUB_WORDS, k=rng.randint(3, 12)))
+    return f"ACTION: {action}\nID: {target}\nCONTENT: {words} #{serial}"
+
+
+# --- Decision providers ---
+
+class StubProvider:
+    """Seeded stub decisions; the same seed gives the same simulation."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.serial = itertools.count(1)
+
+    def decide(self, persona, context, prompt):
+        return stub_decision(context, self.rng, next(self.serial))
+
+
+class ReplayProvider:
+    """Replay decisions recorded with ``--record``.
+
+    Each persona gets its own recorded decisions back in order, wrapping
+    around when they run out. Personas that were never recorded draw from
+    all of them. A recorded reply or quote target is moved to the tweet at
+    the same position in the current context, since the recorded ids don't
+    exist in this timeline.
+    """
+
+    def __init__(self, path):
+        self.by_persona = collections.defaultdict(list)
+        self.all = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.by_persona[record['persona']].append(record)
+                    self.all.append(record)
+        if not self.all:
+            raise ValueError(f'{path} has no recorded decisions')
+        self.positions = collections.Counter()
+
+    def decide(self, persona, context, prompt):
+        records = self.by_persona.get(persona['name']) or self.all
+        position = self.positions[persona['name']]
+        self.positions[persona['name']] += 1
+        record = records[position % len(records)]
+        recorded_ids = record.get('context_ids') or []
+        current_ids = CONTEXT_ID.findall(context)
+
+        def retarget(match):
+            if match[2] in recorded_ids and current_ids:
+                index = min(recorded_ids.index(match[2]), len(current_ids) - 1)
+                return match[1] + current_ids[index]
+            return match[0]
+        return DECISION_ID.sub(retarget, record['decision'])
+
+
+class LLMProvider:
+    """Real LLM calls, for recording decisions to replay later. Token usage
+    is logged through ``timeline``."""
+
+    def __init__(self, config, timeline):
+        self.config = config
+        self.timeline = timeline
+
+    def decide(self, persona, context, prompt):
+        return llm_bot.get_llm_decision(persona, context, self.config, self.timeline)
+
+
+# --- Persona scheduling ---
+
+def make_scheduler(schedule, personas, rng, weights=None):
+    """Return a function giving the personas that act in each cycle."""
+    if schedule == 'round':
+        return lambda: personas
+    if schedule == 'round-robin':
+        cycle = itertools.cycle(personas)
+        return lambda: [next(cycle)]
+    if schedule == 'weighted':
+        odds = [weights.get(p['name'], 1) for p in personas]
+        return lambda: rng.choices(personas, odds)
+    return lambda: [rng.choice(personas)]
+
+def parse_weights(text):
+    weights = {}
+    for item in filter(None, (text or '').split(',')):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+# --- Timeline ---
+
+class SimTimeline:
+    """Timeline backend that keeps the context window in memory and writes
+    posts in batches.
+
+    Buffered posts are shown to bots with provisional ids counting up from
+    ``base``. A reply or quote that targets one becomes a ``"$N"`` batch
+    reference, so it resolves to the real id when the batch is inserted.
+    With ``write=False`` nothing touches the database.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, write=True):
+        self.batch_size = batch_size
+        self.write = write
+        self.recent = collections.deque(maxlen=llm_bot.CONTEXT_TWEET_COUNT)
+        self.pending = []
+        self.posted = 0
+        if write:
+            import app
+            app.init_app()
+            self.app = app
+            self.recent.extend(app.load_tweets(limit=llm_bot.CONTEXT_TWEET_COUNT))
+        self.base = max((t['id'] for t in self.recent), default=0) + 1
+
+    def latest_tweets(self, limit):
+        return list(self.recent)[:limit]
+
+    def post(self, username, payload):
+        post = {'username': username, **payload}
+        for key in ('replying_to', 'quoting_tweet_id'):
+            ref = post.get(key)
+            if ref is not None and ref >= self.base:
+                if ref - self.base < len(self.pending):
+                    post[key] = f'${ref - self.base}'
+                else:
+                    del post[key]
+        self.recent.appendleft({'id': self.base + len(self.pending), 'username': username, 'text': payload['text']})
+        self.pending.append(post)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def post_batch(self, posts):
+        for post in posts:
+            self.post(post['username'], {k: v for k, v in post.items() if k != 'username'})
+
+    def log_token_usage(self, prompt_tokens, completion_tokens, total_tokens, persona):
+        # LLM calls cost tokens even in a dry run, so they are always logged
+        log = self.app.log_token_usage if self.write else llm_bot.log_token_usage
+        log(prompt_tokens, completion_tokens, total_tokens, persona)
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.write:
+            ids = [t['id'] for t in self.app.create_tweets(self.pending)]
+        else:
+            ids = [self.base + i for i in range(len(self.pending))]
+        for tweet in self.recent:
+            if tweet['id'] >= self.base:
+                tweet['id'] = ids[tweet['id'] - self.base]
+        self.posted += len(self.pending)
+        self.base = ids[-1] + 1
+        self.pending = []
+
+
+# --- Runner ---
+
+def simulate(cycles, provider, next_personas, timeline, config, record=None):
+    """Run ``cycles`` bot cycles and return a summary dict.
+
+    Personas acting in the same cycle see the same context, as in
+    ``llm_bot.run_round``. Prompts are built from ``config`` throughout.
+    """
+    actions = collections.Counter()
+    by_persona = collections.Counter()
+    decisions = prompt_chars = max_prompt_chars = invalid = 0
+    started = time.perf_counter()
+    for _ in range(cycles):
+        context = llm_bot.format_context_for_llm(timeline.latest_tweets(llm_bot.CONTEXT_TWEET_COUNT))
+        for persona in next_personas():
+            prompt = llm_bot.build_prompt(persona, context, config)
+            decisions += 1
+            prompt_chars += len(prompt)
+            max_prompt_chars = max(max_prompt_chars, len(prompt))
+            decision = provider.decide(persona, context, prompt)
+            if record is not None and decision:
+                record.write(json.dumps({
+                    'persona': persona['name'],
+                    'decision': decision,
+                    'context_ids': CONTEXT_ID.findall(context),
+                }) + '\n')
+            payload = llm_bot.decision_to_payload(decision)
+            by_persona[persona['name']] += 1
+            if not payload:
+                invalid += 1
+                continue
+            if 'replying_to' in payload:
+                actions['REPLY'] += 1
+            elif 'quoting_tweet_id' in payload:
+                actions['QUOTE'] += 1
+            else:
+                actions['TWEET'] += 1
+            timeline.post(persona['name'], payload)
+    timeline.flush()
+    elapsed = time.perf_counter() - started
+    return {
+        'cycles': cycles,
+        'decisions': decisions,
+        'posts': timeline.posted,
+        'invalid_decisions': invalid,
+        'actions': dict(actions),
+        'decisions_by_persona': dict(by_persona),
+        'elapsed_seconds': round(elapsed, 3),
+        'cycles_per_sec': round(cycles / elapsed, 1) if elapsed else None,
+        'decisions_per_sec': round(decisions / elapsed, 1) if elapsed else None,
+        'mean_prompt_chars': round(prompt_chars / decisions) if decisions else None,
+        'max_prompt_chars': max_prompt_chars,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cycles', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--provider', choices=('stub', 'replay', 'llm'), default='stub')
+    parser.add_argument('--replay', help='decisions file for --provider replay')
+    parser.add_argument('--record', help='append every decision to this file for later replay')
+    parser.add_argument('--schedule', choices=('random', 'round-robin', 'weighted', 'round'), default='random',
+                        help='which personas act each cycle (round: all of them)')
+    parser.add_argument('--weights', help='persona odds for --schedule weighted, e.g. GrumpyCatBot=3,HistoryBuff=1')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='posts per write transaction')
+    parser.add_argument('--dry-run', action='store_true', help="don't write to tweets.db")
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own output")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.provider == 'replay' and not args.replay:
+        sys.exit('--provider replay needs --replay FILE')
+    rng = random.Random(args.seed)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet, contextlib.ExitStack() as stack:
+        config = llm_bot.get_prompt_config()
+        personas = config.personas
+        if not personas:
+            sys.exit('No personas available.')
+        next_personas = make_scheduler(args.schedule, personas, rng, parse_weights(args.weights))
+        timeline = SimTimeline(args.batch_size, write=not args.dry_run)
+        provider = {
+            'stub': lambda: StubProvider(rng),
+            'replay': lambda: ReplayProvider(args.replay),
+            'llm': lambda: LLMProvider(config, timeline),
+        }[args.provider]()
+        record = stack.enter_context(open(args.record, 'a', encoding='utf-8')) if args.record else None
+        summary = simulate(args.cycles, provider, next_personas, timeline, config, record)
+
+    summary.update({'seed': args.seed, 'provider': args.provider, 'schedule': args.schedule})
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,134 @@
 (() => {
+    const FEED_PAGE_SIZE = 50;
+    // Height assumed for feed tweets that haven't been rendered yet, and how far
+    // beyond the viewport the rendered window of tweets extends
+    const ESTIMATED_TWEET_HEIGHT = 140;
+    const OVERSCAN_PX = 800;
+    // Wait before reopening an event stream the server refused or closed
+    const STREAM_RETRY_MS = 30000;
+
     const App = {
         elements: { mainContent: null },
-        state: { allTweetsById: {}, composer: {}, lastUsername: '' },
+        state: {
+            allTweetsById: {}, cursor: 0, streaming: false, composer: {}, lastUsername: '',
+            // Keyset cursor for the next (older) feed page and the oldest tweet loaded so far
+            feedNext: null, feedOldest: null, loadingMore: false,
+            etag: null,
+            // 'feed' while the feed shell is in the DOM, else the hash of the view shown
+            view: null,
+        },
+        // Virtualized feed: the sorted tweet list, measured heights by id, and the
+        // rendered node plus its HTML for each tweet in the window, by id
+        feed: { tweets: [], heights: new Map(), nodes: new Map(), frame: null },
 
-        init() {
+        async init() {
             this.elements.mainContent = document.getElementById('main-content');
             this.state.lastUsername = localStorage.getItem('lanTwttrUsername') || '';
+            this.attachEventListeners();
             window.addEventListener('hashchange', () => this.router());
-            this.router();
-            // Refresh the view periodically to show new tweets
-            setInterval(() => this.router(), 1000);
+            await this.router();
+            this.openStream();
+            // Fall back to polling whenever the event stream is down
+            setInterval(() => { if (!this.state.streaming) this.poll(); }, 1000);
         },
         
+        openStream() {
+            if (!window.EventSource) return;
+            const source = new EventSource(`/api/stream?last_event_id=${this.state.cursor}`);
+            source.onopen = () => { this.state.streaming = true; };
+            source.onerror = () => {
+                this.state.streaming = false;
+                // EventSource gives up on a refused stream (503 when the
+                // server has too many); poll meanwhile and try again later
+                if (source.readyState === EventSource.CLOSED) {
+                    setTimeout(() => this.openStream(), STREAM_RETRY_MS);
+                }
+            };
+            source.addEventListener('delta', e => {
+                const delta = JSON.parse(e.data);
+                if (delta.cursor <= this.state.cursor) return;
+                // A gap between our cursor and this event means we missed something
+                if (delta.since > this.state.cursor) { this.router(); return; }
+                this.applyDelta(delta);
+                this.render();
+            });
+            source.addEventListener('resync', () => this.router());
+        },
+
+        applyDelta(delta) {
+            delta.tweets.forEach(t => { this.state.allTweetsById[t.id] = t; });
+            delta.deleted.forEach(id => { delete this.state.allTweetsById[id]; });
+            this.state.cursor = delta.cursor;
+        },
+
+        // Merge one feed page and the parent/quoted tweets it side-loads
+        applyPage(page) {
+            Object.values(page.included).forEach(t => { this.state.allTweetsById[t.id] = t; });
+            page.tweets.forEach(t => { this.state.allTweetsById[t.id] = t; });
+            if (page.tweets.length) this.state.feedOldest = page.tweets[page.tweets.length - 1];
+            this.state.feedNext = page.next;
+        },
+
+        // Fetch only what changed since the last poll and merge it into the cache.
+        // With no (or a stale) cursor the server answers with the first feed page instead.
+        // The ETag from the last poll turns an unchanged timeline into a bodiless 304.
+        // Returns whether anything changed.
+        async syncTweets() {
+            const headers = this.state.etag ? { 'If-None-Match': this.state.etag } : {};
+            const response = await fetch(`/api/tweets?since=${this.state.cursor}&limit=${FEED_PAGE_SIZE}`, { headers, cache: 'no-store' });
+            if (response.status === 304) return false;
+            this.state.etag = response.headers.get('ETag');
+            const data = await response.json();
+            if (data.full) {
+                this.state.allTweetsById = {};
+                this.state.feedOldest = null;
+                this.applyPage(data);
+                this.state.cursor = data.cursor;
+            } else {
+                this.applyDelta(data);
+            }
+            return true;
+        },
+
+        async loadMore() {
+            if (this.state.loadingMore || !this.state.feedNext) return;
+            this.state.loadingMore = true;
+            try {
+                const response = await fetch(`/api/tweets?limit=${FEED_PAGE_SIZE}&before=${encodeURIComponent(this.state.feedNext)}`);
+                this.applyPage(await response.json());
+            } finally {
+                this.state.loadingMore = false;
+            }
+            this.render();
+        },
+
+        // Loaded tweets that belong in the feed: everything down to the oldest
+        // loaded page, but not side-loaded tweets older than that
+        feedTweets() {
+            const oldest = this.state.feedOldest;
+            return Object.values(this.state.allTweetsById)
+                .filter(t => !this.state.feedNext || !oldest || t.timestamp > oldest.timestamp || (t.timestamp === oldest.timestamp && t.id >= oldest.id))
+                .sort((a, b) => (a.timestamp < b.timestamp ? 1 : a.timestamp > b.timestamp ? -1 : b.id - a.id));
+        },
+
         async router() {
-            const response = await fetch('/api/tweets');
-            const tweets = await response.json();
-            this.state.allTweetsById = Object.fromEntries(tweets.map(t => [t.id, t]));
-            this.state.composer = { replying_to: null, quoting: null };
+            await this.syncTweets();
+            this.render();
+        },
+
+        async poll() {
+            if (await this.syncTweets()) this.render();
+        },
 
+        render() {
             const hash = window.location.hash;
             const tweetDetailMatch = hash.match(/^#\/tweet\/(\d+)$/);
             const quotesMatch = hash.match(/^#\/tweet\/(\d+)\/quotes$/);
 
-            if (tweetDetailMatch) this.renderTweetDetailView(parseInt(tweetDetailMatch[1]), tweets);
-            else if (quotesMatch) this.renderQuotesView(parseInt(quotesMatch[1]), tweets);
-            else this.renderMainFeed(tweets);
-            this.attachEventListeners();
+            // The thread and quote views load their own data
+            if (tweetDetailMatch) { this.state.view = hash; this.renderTweetDetailView(parseInt(tweetDetailMatch[1])); return; }
+            if (quotesMatch) { this.state.view = hash; this.renderQuotesView(parseInt(quotesMatch[1])); return; }
+            this.renderMainFeed(this.feedTweets());
         },
 
         formatDate: (isoString) => new Date(isoString).toLocaleString(),
@@ -79,37 +182,178 @@
                         <div class="button-row">
                             <button type="button" id="run-bot-btn">Run Bot</button>
                             <button type="button" id="run-bot-five-btn">Run Bot 5x</button>
+                            <button type="button" id="run-round-btn">Run Round</button>
                             <button type="submit">Tweet</button>
                         </div>
                     </form>
                 </div>`;
         },
+        // The header, composer and feed container are built once per visit to the
+        // feed; after that only the tweets in the window are patched
         renderMainFeed(tweets) {
-            this.elements.mainContent.innerHTML = `
-                <header><h1>LAN Twitter</h1><a href="prompts.html" class="prompts-link">Prompts</a> <a href="tokens.html" class="prompts-link">Usage</a></header>
-                ${this.getComposerHTML()}
-                <div id="tweet-feed">
-                    ${tweets.map(t => this.getTweetHTML(t)).join('')}
-                </div>`;
+            if (this.state.view !== 'feed') {
+                this.state.view = 'feed';
+                this.state.composer = { replying_to: null, quoting: null };
+                this.feed.nodes.clear();
+                this.elements.mainContent.innerHTML = `
+                    <header><h1>LAN Twitter</h1><a href="prompts.html" class="prompts-link">Prompts</a> <a href="tokens.html" class="prompts-link">Usage</a></header>
+                    ${this.getComposerHTML()}
+                    <div id="tweet-feed"><div id="feed-top-spacer"></div><div id="feed-items"></div><div id="feed-bottom-spacer"></div></div>
+                    <div id="feed-sentinel" hidden>Loading…</div>`;
+            }
+            this.feed.tweets = tweets;
+            this.patchFeed();
+            this.observeSentinel();
         },
-        renderTweetDetailView(tweetId, tweets) { const parentTweet = this.state.allTweetsById[tweetId]; if (!parentTweet) { this.elements.mainContent.innerHTML = `<h2>Tweet not found</h2><a href="#">Back</a>`; return; } const replies = tweets.filter(t => t.replying_to === parentTweet.id); this.elements.mainContent.innerHTML = `<div class="view-header"><a href="#" class="back-button">←</a><h2>Thread</h2></div><div id="tweet-feed">${this.getTweetHTML(parentTweet, true)}${replies.map(t => this.getTweetHTML(t)).join('')}</div>${this.getComposerHTML()}`; this.state.composer = { replying_to: { id: parentTweet.id, username: parentTweet.username }, quoting: null }; document.getElementById('composer-context').innerHTML = `Replying to @${parentTweet.username} <button id="cancel-action">Cancel</button>`; },
-        renderQuotesView(tweetId, tweets) { const parentTweet = this.state.allTweetsById[tweetId]; if (!parentTweet) { this.elements.mainContent.innerHTML = `<h2>Tweet not found</h2><a href="#">Back</a>`; return; } const quotes = tweets.filter(t => t.quoting_tweet_id === parentTweet.id); this.elements.mainContent.innerHTML = `<div class="view-header"><a href="#/tweet/${tweetId}" class="back-button">←</a><h2>Quotes for Tweet by @${parentTweet.username}</h2></div><div id="tweet-feed">${quotes.map(t => this.getTweetHTML(t)).join('')}</div>`; },
+        // Render only the tweets within OVERSCAN_PX of the viewport; spacers stand in
+        // for the rest, sized from measured heights where known. Nodes are keyed by
+        // tweet id and replaced only when their HTML changes.
+        patchFeed() {
+            const items = document.getElementById('feed-items');
+            if (!items) return;
+            const { tweets, heights, nodes } = this.feed;
+            const anchor = this.scrollAnchor(items);
 
-        attachEventListeners() {
-            this.elements.mainContent.addEventListener('click', e => this.handleMainClick(e));
-            const tweetForm = document.getElementById('tweet-form');
-            if (tweetForm) {
-                tweetForm.addEventListener('submit', e => this.handleFormSubmit(e));
-                document.getElementById('tweet-text-input').addEventListener('keydown', e => this.handleKeyDown(e));
+            const offsets = [0];
+            tweets.forEach((t, i) => { offsets.push(offsets[i] + (heights.get(t.id) || ESTIMATED_TWEET_HEIGHT)); });
+            const feedTop = items.parentElement.getBoundingClientRect().top + window.scrollY;
+            if (anchor) {
+                // Scroll to where the anchor will be first, so the window is built around it
+                const index = tweets.findIndex(t => t.id === anchor.id);
+                if (index >= 0) window.scrollTo(0, feedTop + offsets[index] - anchor.top);
+            }
+            const start = this.firstOffsetAbove(offsets, window.scrollY - feedTop - OVERSCAN_PX);
+            const end = Math.min(tweets.length, this.firstOffsetAbove(offsets, window.scrollY + window.innerHeight - feedTop + OVERSCAN_PX) + 1);
+            const visible = tweets.slice(start, end);
+
+            const keep = new Set(visible.map(t => t.id));
+            nodes.forEach((entry, id) => { if (!keep.has(id)) { entry.el.remove(); nodes.delete(id); } });
+            let previous = null;
+            visible.forEach(t => {
+                const html = this.getTweetHTML(t);
+                let entry = nodes.get(t.id);
+                if (!entry || entry.html !== html) {
+                    const el = this.createNode(html);
+                    if (entry) entry.el.replaceWith(el);
+                    entry = { el, html };
+                    nodes.set(t.id, entry);
+                }
+                const expected = previous ? previous.nextSibling : items.firstChild;
+                if (entry.el !== expected) items.insertBefore(entry.el, expected);
+                previous = entry.el;
+            });
+            document.getElementById('feed-top-spacer').style.height = `${offsets[start]}px`;
+            document.getElementById('feed-bottom-spacer').style.height = `${offsets[tweets.length] - offsets[end]}px`;
+
+            let remeasured = false;
+            visible.forEach(t => {
+                const height = nodes.get(t.id).el.offsetHeight;
+                if (height && height !== heights.get(t.id)) { heights.set(t.id, height); remeasured = true; }
+            });
+            const anchorNode = anchor && nodes.get(anchor.id);
+            if (anchorNode) window.scrollBy(0, anchorNode.el.getBoundingClientRect().top - anchor.top);
+            // Estimates were off, so the window may not cover the viewport yet
+            if (remeasured) this.schedulePatch();
+        },
+        // Index of the first tweet whose bottom edge is below y
+        firstOffsetAbove(offsets, y) {
+            let lo = 0, hi = offsets.length - 1;
+            while (lo < hi) {
+                const mid = (lo + hi) >> 1;
+                if (offsets[mid + 1] > y) hi = mid; else lo = mid + 1;
+            }
+            return lo;
+        },
+        // Once the feed is scrolled, the first tweet in view keeps its position
+        // on screen while tweets are added or resized above it
+        scrollAnchor(items) {
+            if (items.parentElement.getBoundingClientRect().top >= 0) return null;
+            const el = [...items.children].find(child => child.getBoundingClientRect().bottom > 0);
+            return el ? { id: Number(el.dataset.tweetId), top: el.getBoundingClientRect().top } : null;
+        },
+        schedulePatch() {
+            if (this.feed.frame) return;
+            this.feed.frame = requestAnimationFrame(() => {
+                this.feed.frame = null;
+                if (this.state.view === 'feed') this.patchFeed();
+            });
+        },
+        createNode(html) {
+            const template = document.createElement('template');
+            template.innerHTML = html.trim();
+            return template.content.firstElementChild;
+        },
+        // Infinite scroll: load the next page when the end of the feed comes into view
+        observeSentinel() {
+            const sentinel = document.getElementById('feed-sentinel');
+            if (!sentinel) return;
+            sentinel.hidden = !this.state.feedNext;
+            if (!this.feedObserver) {
+                this.feedObserver = new IntersectionObserver(entries => {
+                    if (entries.some(e => e.isIntersecting)) this.loadMore();
+                }, { rootMargin: '400px' });
             }
-            const runBotBtn = document.getElementById('run-bot-btn');
-            if (runBotBtn) runBotBtn.addEventListener('click', () => this.runBot());
-            const runBotFiveBtn = document.getElementById('run-bot-five-btn');
-            if (runBotFiveBtn) runBotFiveBtn.addEventListener('click', () => this.runBotFive());
+            // Re-observing reports the current state, so a sentinel still in view
+            // after a page loads asks for the next one
+            this.feedObserver.disconnect();
+            if (this.state.feedNext) this.feedObserver.observe(sentinel);
+        },
+        async renderTweetDetailView(tweetId) {
+            const hash = window.location.hash;
+            const response = await fetch(`/api/tweets/${tweetId}/thread`);
+            if (window.location.hash !== hash) return; // navigated away meanwhile
+            if (!response.ok) { this.elements.mainContent.innerHTML = `<h2>Tweet not found</h2><a href="#">Back</a>`; return; }
+            const thread = await response.json();
+            const parentTweet = thread.tweet;
+            [...thread.ancestors, parentTweet, ...thread.replies].forEach(t => { this.state.allTweetsById[t.id] = t; });
+            const ancestorsHTML = thread.ancestors.map(t => this.getTweetHTML(t)).join('');
+            const repliesHTML = this.orderReplyTree(parentTweet.id, thread.replies)
+                .map(t => `<div class="thread-reply" style="margin-left: ${Math.min(t.depth - 1, 8) * 20}px">${this.getTweetHTML(t)}</div>`)
+                .join('');
+            const truncatedHTML = thread.counts.truncated ? '<p class="thread-truncated">Some replies are not shown.</p>' : '';
+            this.elements.mainContent.innerHTML = `<div class="view-header"><a href="#" class="back-button">←</a><h2>Thread</h2></div><div id="tweet-feed">${ancestorsHTML}${this.getTweetHTML(parentTweet, true)}${repliesHTML}${truncatedHTML}</div>${this.getComposerHTML()}`;
+            this.state.composer = { replying_to: { id: parentTweet.id, username: parentTweet.username }, quoting: null };
+            document.getElementById('composer-context').innerHTML = `Replying to @${parentTweet.username} <button id="cancel-action">Cancel</button>`;
+        },
+        // Depth-first order so each reply sits directly under its parent
+        orderReplyTree(rootId, replies) {
+            const children = {};
+            replies.forEach(t => { (children[t.replying_to] = children[t.replying_to] || []).push(t); });
+            const ordered = [];
+            const visit = id => (children[id] || []).forEach(t => { ordered.push(t); visit(t.id); });
+            visit(rootId);
+            return ordered;
+        },
+        async renderQuotesView(tweetId) {
+            const hash = window.location.hash;
+            const [parentRes, quotesRes] = await Promise.all([fetch(`/api/tweets/${tweetId}`), fetch(`/api/tweets?quoting=${tweetId}`)]);
+            if (window.location.hash !== hash) return;
+            if (!parentRes.ok) { this.elements.mainContent.innerHTML = `<h2>Tweet not found</h2><a href="#">Back</a>`; return; }
+            const parentTweet = await parentRes.json();
+            const quotes = await quotesRes.json();
+            [parentTweet, ...quotes].forEach(t => { this.state.allTweetsById[t.id] = t; });
+            this.state.composer = { replying_to: null, quoting: null };
+            this.elements.mainContent.innerHTML = `<div class="view-header"><a href="#/tweet/${tweetId}" class="back-button">←</a><h2>Quotes for Tweet by @${parentTweet.username}</h2></div><div id="tweet-feed">${quotes.map(t => this.getTweetHTML(t)).join('')}</div>`;
+        },
+
+        // One set of delegated listeners on the main content, attached once, so
+        // views can replace their markup without rebinding anything
+        attachEventListeners() {
+            const main = this.elements.mainContent;
+            main.addEventListener('click', e => this.handleMainClick(e));
+            main.addEventListener('submit', e => { if (e.target.id === 'tweet-form') this.handleFormSubmit(e); });
+            main.addEventListener('keydown', e => { if (e.target.id === 'tweet-text-input') this.handleKeyDown(e); });
+            window.addEventListener('scroll', () => this.schedulePatch(), { passive: true });
+            window.addEventListener('resize', () => this.schedulePatch());
         },
 
         async handleMainClick(e) {
             const target = e.target;
+            if (target.id === 'run-bot-btn') { this.runBot(); return; }
+            if (target.id === 'run-bot-five-btn') { this.runBotFive(); return; }
+            if (target.id === 'run-round-btn') { this.runBot(1, 'round'); return; }
+            if (target.id === 'cancel-action') { this.state.composer = { replying_to: null, quoting: null }; document.getElementById('composer-context').innerHTML = ''; return; }
+
             const tweetElement = target.closest('[data-tweet-id]');
             if (!tweetElement) return;
             const tweetId = tweetElement.dataset.tweetId;
@@ -133,16 +377,17 @@
             else if (target.closest('.quoted-tweet-container')) { window.location.hash = `#/tweet/${tweetId}`; }
 
             if (target.classList.contains('reply-btn')) { const username = target.dataset.username; this.state.composer = { replying_to: { id: tweetId, username }, quoting: null }; document.getElementById('composer-context').innerHTML = `Replying to @${username} <button id="cancel-action">Cancel</button>`; document.getElementById('tweet-text-input').focus(); }
-            if (target.id === 'cancel-action') { this.state.composer = { replying_to: null, quoting: null }; document.getElementById('composer-context').innerHTML = ''; }
         },
 
-        async handleFormSubmit(e) { e.preventDefault(); const usernameInput = document.getElementById('username-input'); const username = usernameInput.value.trim(); const text = document.getElementById('tweet-text-input').value.trim(); if (!username || !text) return; const payload = { username, text }; if (this.state.composer.replying_to) payload.replying_to = parseInt(this.state.composer.replying_to.id); await fetch('/api/tweets', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload), }); localStorage.setItem('lanTwttrUsername', username); this.state.lastUsername = username; this.router(); },
-        async runBot() { await fetch('/api/run_bot', { method: 'POST' }); },
-        runBotFive() {
-            for (let i = 0; i < 5; i++) {
-                setTimeout(() => this.runBot(), i * 2000);
-            }
+        async handleFormSubmit(e) { e.preventDefault(); const usernameInput = document.getElementById('username-input'); const username = usernameInput.value.trim(); const text = document.getElementById('tweet-text-input').value.trim(); if (!username || !text) return; const payload = { username, text }; if (this.state.composer.replying_to) payload.replying_to = parseInt(this.state.composer.replying_to.id); await fetch('/api/tweets', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload), }); localStorage.setItem('lanTwttrUsername', username); this.state.lastUsername = username; document.getElementById('tweet-text-input').value = ''; if (this.state.view === 'feed') { this.state.composer = { replying_to: null, quoting: null }; document.getElementById('composer-context').innerHTML = ''; } this.router(); },
+        async runBot(cycles = 1, mode = 'single') {
+            await fetch('/api/run_bot', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ cycles, mode }),
+            });
         },
+        runBotFive() { this.runBot(5); },
         handleKeyDown(e) { if (e.key === 'Enter' && (e.metaKey || e.ctrlKey)) { e.preventDefault(); document.getElementById('tweet-form').requestSubmit(); } }
     };
 
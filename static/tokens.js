@@ -1,14 +1,56 @@
 (() => {
-    async function loadUsage() {
-        const res = await fetch('/api/token_usage');
-        const data = await res.json();
-        const container = document.getElementById('tokens-container');
-        const list = data.map(u => `
+    let nextBeforeId = null;
+
+    function usageRowHTML(u) {
+        return `
             <li>
                 <strong>${u.timestamp}</strong> - persona <em>${u.persona || ''}</em>: prompt ${u.prompt_tokens}, completion ${u.completion_tokens}, total ${u.total_tokens}
             </li>
+        `;
+    }
+
+    async function loadSummary() {
+        const [summaryRes, daysRes] = await Promise.all([
+            fetch('/api/token_usage/summary'),
+            fetch('/api/token_usage/buckets?bucket=day&limit=14'),
+        ]);
+        const summary = await summaryRes.json();
+        const days = await daysRes.json();
+        const { totals, percentiles } = summary;
+        const personaRows = summary.personas.map(p => `
+            <tr><td>${p.persona || '(none)'}</td><td>${p.calls}</td><td>${p.prompt_tokens}</td><td>${p.completion_tokens}</td><td>${p.total_tokens}</td></tr>
+        `).join('');
+        const dayRows = days.map(d => `
+            <tr><td>${d.bucket}</td><td>${d.calls}</td><td>${d.prompt_tokens}</td><td>${d.completion_tokens}</td><td>${d.total_tokens}</td></tr>
         `).join('');
-        container.innerHTML = `<ul id="usage-list">${list}</ul>`;
+        const header = '<th>Calls</th><th>Prompt</th><th>Completion</th><th>Total</th>';
+        return `
+            <p id="usage-totals">${totals.calls} calls, ${totals.total_tokens} tokens in total.
+                Tokens per call: p50 &le; ${percentiles.p50 ?? '-'}, p95 &le; ${percentiles.p95 ?? '-'}</p>
+            <h2>By persona</h2>
+            <table class="usage-table"><tr><th>Persona</th>${header}</tr>${personaRows}</table>
+            <h2>By day</h2>
+            <table class="usage-table"><tr><th>Day</th>${header}</tr>${dayRows}</table>
+            <h2>Recent calls</h2>
+            <ul id="usage-list"></ul>
+            <button id="load-more-usage">Load more</button>
+        `;
+    }
+
+    async function loadMoreUsage() {
+        const url = nextBeforeId ? `/api/token_usage?before_id=${nextBeforeId}` : '/api/token_usage';
+        const res = await fetch(url);
+        const page = await res.json();
+        document.getElementById('usage-list').insertAdjacentHTML('beforeend', page.usage.map(usageRowHTML).join(''));
+        nextBeforeId = page.next_before_id;
+        document.getElementById('load-more-usage').style.display = nextBeforeId ? '' : 'none';
+    }
+
+    async function loadUsage() {
+        const container = document.getElementById('tokens-container');
+        container.innerHTML = await loadSummary();
+        document.getElementById('load-more-usage').addEventListener('click', loadMoreUsage);
+        await loadMoreUsage();
     }
 
     document.addEventListener('DOMContentLoaded', loadUsage);
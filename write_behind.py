@@ -0,0 +1,178 @@
+# write_behind.py
+"""Background writer that batches like increments and token-usage rows."""
+import atexit
+import threading
+from contextlib import contextmanager
+
+import db
+
+FLUSH_INTERVAL_SECONDS = 0.005
+MAX_BATCH = 500
+
+
+class WriteBehind:
+    """Queue writes and commit them in one transaction per batch.
+
+    Like increments are coalesced per tweet, so a burst of N likes on one
+    tweet becomes a single UPDATE. A batch is written once it reaches
+    ``max_batch`` items or ``flush_interval`` seconds after its first item,
+    whichever comes first. Pending writes are flushed at interpreter exit.
+
+    ``on_flush(liked_ids)`` runs after each batch of likes is committed.
+    Likes are applied to every table in ``like_tables``, so a tweet gets
+    them wherever it is stored.
+    """
+
+    def __init__(self, tweets_db=None, prompts_db=None, on_flush=None,
+                 flush_interval=FLUSH_INTERVAL_SECONDS, max_batch=MAX_BATCH, like_tables=('tweets',)):
+        self.tweets_db = tweets_db
+        self.prompts_db = prompts_db
+        self.on_flush = on_flush
+        self.like_tables = like_tables
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        # Readers merging pending likes share the tweets; a commit waits for
+        # them to finish and holds new ones off until it is done
+        self._readers = 0
+        self._committing = False
+        self._likes = {}
+        self._in_flight_likes = {}
+        # Bumped on every queued like, so callers can tell that reads which
+        # merge pending likes may have changed without a commit
+        self.like_generation = 0
+        self._usage = []
+        self._in_flight = False
+        self._flush_requested = False
+        self._thread = None
+        self._stopping = False
+
+    def _pending_count(self):
+        return len(self._likes) + len(self._usage)
+
+    def _enqueued(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        count = self._pending_count()
+        if count == 1 or count >= self.max_batch:
+            self._cond.notify_all()
+
+    def add_like(self, tweet_id, count=1):
+        with self._cond:
+            self._likes[tweet_id] = self._likes.get(tweet_id, 0) + count
+            self.like_generation += 1
+            self._enqueued()
+
+    def add_token_usage(self, row):
+        """Queue a (timestamp, prompt_tokens, completion_tokens, total_tokens,
+        persona) row for the token_usage table."""
+        with self._cond:
+            self._usage.append(row)
+            self._enqueued()
+
+    @contextmanager
+    def reading_likes(self):
+        """Hold off commits while the caller reads tweets.
+
+        Yields {tweet_id: increment} for likes that are queued but not yet
+        committed, so reads inside the block can add them to like_count.
+        Any number of readers can be inside the block at once; only a batch
+        being committed makes them wait.
+        """
+        with self._cond:
+            while self._committing:
+                self._cond.wait()
+            self._readers += 1
+            pending = dict(self._in_flight_likes)
+            for tweet_id, count in self._likes.items():
+                pending[tweet_id] = pending.get(tweet_id, 0) + count
+        try:
+            yield pending
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending_count() and not self._stopping:
+                    self._cond.wait()
+                if not self._pending_count():
+                    return
+                if self._pending_count() < self.max_batch and not (self._stopping or self._flush_requested):
+                    # Let the batch fill up a little
+                    self._cond.wait(self.flush_interval)
+                likes, usage = self._likes, self._usage
+                self._likes, self._usage = {}, []
+                self._in_flight_likes = likes
+                self._in_flight = True
+            self._flush(likes, usage)
+
+    def _flush(self, likes, usage):
+        with self._cond:
+            # Token usage isn't merged into reads, so only likes need readers out
+            self._committing = bool(likes)
+            while self._committing and self._readers:
+                self._cond.wait()
+        try:
+            if likes:
+                self._write_likes(likes)
+            if usage:
+                self._write_usage(usage)
+        except Exception as e:
+            print(f"ERROR: Write-behind flush failed. {e}")
+        finally:
+            with self._cond:
+                self._in_flight_likes = {}
+                self._in_flight = False
+                self._committing = False
+                if not self._pending_count():
+                    self._flush_requested = False
+                self._cond.notify_all()
+        if likes and self.on_flush:
+            self.on_flush(list(likes))
+
+    @db.retry_on_busy
+    def _write_likes(self, likes):
+        rows = [(count, tweet_id) for tweet_id, count in likes.items()]
+        with db.transaction(self.tweets_db) as conn:
+            for table in self.like_tables:
+                conn.executemany(f'UPDATE {table} SET like_count = COALESCE(like_count, 0) + ? WHERE id=?', rows)
+
+    @db.retry_on_busy
+    def _write_usage(self, usage):
+        with db.transaction(self.prompts_db) as conn:
+            conn.executemany(
+                "INSERT INTO token_usage (timestamp, prompt_tokens, completion_tokens, total_tokens, persona) VALUES (?, ?, ?, ?, ?)",
+                usage,
+            )
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending_count() or self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def add_pending_likes(tweets, pending):
+    """Add queued like increments from ``reading_likes()`` to tweet dicts,
+    unless they were loaded without ``like_count``."""
+    if pending and tweets and 'like_count' in tweets[0]:
+        for tweet in tweets:
+            tweet['like_count'] = (tweet['like_count'] or 0) + pending.get(tweet['id'], 0)
+    return tweets